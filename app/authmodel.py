@@ -1,3 +1,5 @@
+import threading
+import time
 from graphsenserest import db
 from passlib.hash import pbkdf2_sha256 as sha256
 
@@ -48,3 +50,39 @@ class RevokedJWTToken(db.Model):
     def is_jti_blacklisted(cls, jti):
         query = cls.query.filter_by(jti=jti).first()
         return bool(query)
+
+
+class RevokedTokenSet(object):
+    """JTIs of the revoked tokens, held in memory by each worker.
+
+    Revocations of other workers are read every sync_interval seconds,
+    only the rows with an id above the highest one seen so far, so they
+    take effect in all workers within sync_interval."""
+
+    def __init__(self, sync_interval):
+        self.sync_interval = sync_interval
+        self.jtis = set()
+        self.last_id = 0
+        self.synced = None
+        self.lock = threading.Lock()
+
+    def sync(self):
+        with self.lock:
+            rows = db.session.query(RevokedJWTToken.id, RevokedJWTToken.jti) \
+                .filter(RevokedJWTToken.id > self.last_id).all()
+            for (id, jti) in rows:
+                self.jtis.add(jti)
+                self.last_id = max(self.last_id, id)
+            self.synced = time.monotonic()
+
+    def revoke(self, jti):
+        RevokedJWTToken(jti=jti).add()
+        self.jtis.add(jti)
+
+    def __contains__(self, jti):
+        if self.synced is None or time.monotonic() - self.synced >= self.sync_interval:
+            self.sync()
+        return jti in self.jtis
+
+    def __len__(self):
+        return len(self.jtis)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import json
+from os import sys
+import cassandra.cluster
+from cassandra.query import SimpleStatement
+import searchindex
+
+
+def scan(session, query):
+    statement = SimpleStatement(query, fetch_size=10000)
+    for row in session.execute(statement, timeout=None):
+        yield row[0]
+
+
+def last_block_height(session, raw):
+    """Highest block height of keyspace raw, by exponential and binary
+    search over the heights."""
+    statement = session.prepare("SELECT height FROM %s.block WHERE height = ?" % raw)
+
+    def exists(height):
+        return bool(session.execute(statement, [height]).current_rows)
+    (low, high) = (0, 1)
+    while exists(high):
+        (low, high) = (high, high * 2)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if exists(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def transformed_height(session, transformed):
+    """Height of the last block in the transformed keyspace."""
+    rows = session.execute("SELECT no_blocks FROM %s.summary_statistics LIMIT 1" % transformed)
+    return max(rows[0].no_blocks - 1, 0) if rows else 0
+
+
+if __name__ == "__main__":
+
+    with open("./config.json", "r") as fp:
+        config = json.load(fp)
+    directory = config.get("SEARCH_INDEX_DIR") or "/var/lib/graphsense-rest/search"
+    currencies = sys.argv[1:] or [currency for currency in config["MAPPING"]
+                                  if currency != "tagpacks"]
+
+    cluster = cassandra.cluster.Cluster(config["CASSANDRA_NODES"])
+    session = cluster.connect()
+    for currency in currencies:
+        (raw, transformed) = config["MAPPING"][currency]
+        # heights are taken before the scans, so that the blocks added
+        # during a scan are picked up by the running workers
+        print("Indexing addresses of %s ..." % currency)
+        height = transformed_height(session, transformed)
+        searchindex.write_index(
+            directory, "%s.address" % transformed,
+            scan(session, "SELECT address FROM %s.address" % transformed), height)
+        print("Indexing transactions of %s ..." % currency)
+        height = last_block_height(session, raw)
+        searchindex.write_index(
+            directory, "%s.transaction" % raw,
+            (tx_hash.hex() for tx_hash
+             in scan(session, "SELECT tx_hash FROM %s.transaction" % raw)), height)
+    cluster.shutdown()
+    print("Indices written to %s" % directory)
@@ -0,0 +1,105 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+MISSING = object()
+
+
+class MemoryCache(object):
+    """Size-bounded LRU cache with a per-entry time to live, local to the
+    worker process."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisCache(object):
+    """Cache shared by all workers in a Redis compatible server. Entries
+    expire after ttl seconds; the size bound is left to the server's
+    maxmemory eviction policy."""
+
+    def __init__(self, client, name, ttl):
+        self.client = client
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return 0
+
+    def get(self, key):
+        data = self.client.get("%s:%s" % (self.name, key))
+        if data is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        self.client.set("%s:%s" % (self.name, key), pickle.dumps(value),
+                        ex=self.ttl)
+
+    def clear(self):
+        # keys contain the cache generation, stale entries just expire
+        pass
+
+
+def create_caches(config, entities):
+    """Create a cache per entity from the CACHE section of config.json,
+    e.g. {"BACKEND": "memory", "MAXSIZE": 100000, "TTL": {"address": 600}}.
+    Entities without a TTL are not cached."""
+    backend = config.get("BACKEND", "memory")
+    maxsize = config.get("MAXSIZE", 100000)
+    ttls = config.get("TTL", {})
+    if backend == "redis":
+        if redis is None:
+            raise ImportError("The redis cache backend requires the redis package")
+        client = redis.Redis.from_url(config.get("REDIS_URL", "redis://localhost:6379/0"))
+    elif backend != "memory":
+        raise ValueError("Unknown cache backend %s" % backend)
+
+    caches = {}
+    for entity in entities:
+        if not ttls.get(entity):
+            continue
+        if backend == "redis":
+            caches[entity] = RedisCache(client, "graphsense:" + entity, ttls[entity])
+        else:
+            caches[entity] = MemoryCache(maxsize, ttls[entity])
+    return caches
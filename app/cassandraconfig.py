@@ -0,0 +1,83 @@
+from cassandra import ConsistencyLevel
+from cassandra.cluster import EXEC_PROFILE_DEFAULT, ExecutionProfile
+from cassandra.policies import (ConstantSpeculativeExecutionPolicy,
+                                DCAwareRoundRobinPolicy, TokenAwarePolicy)
+
+
+# point lookups of single rows or partitions
+LOOKUP = "lookup"
+# paged listings and bulk loads
+SCAN = "scan"
+
+default_profiles = {
+    "default": {"CONSISTENCY": "LOCAL_ONE", "TIMEOUT": 10},
+    LOOKUP: {"CONSISTENCY": "LOCAL_ONE", "TIMEOUT": 5,
+             "SPECULATIVE_DELAY": 0.05, "SPECULATIVE_ATTEMPTS": 2},
+    SCAN: {"CONSISTENCY": "LOCAL_ONE", "TIMEOUT": 60},
+}
+
+
+def load_balancing_policy(config):
+    policy = DCAwareRoundRobinPolicy(
+        local_dc=config.get("LOCAL_DC"),
+        used_hosts_per_remote_dc=config.get("USED_HOSTS_PER_REMOTE_DC", 0))
+    if config.get("TOKEN_AWARE", True):
+        policy = TokenAwarePolicy(policy)
+    return policy
+
+
+def execution_profile(config, profile):
+    """ExecutionProfile of one entry of PROFILES."""
+    consistency = profile.get("CONSISTENCY", "LOCAL_ONE")
+    if consistency not in ConsistencyLevel.name_to_value:
+        raise ValueError("Unknown consistency level %s" % consistency)
+    speculative_execution_policy = None
+    if profile.get("SPECULATIVE_ATTEMPTS"):
+        speculative_execution_policy = ConstantSpeculativeExecutionPolicy(
+            profile.get("SPECULATIVE_DELAY", 0.05), profile["SPECULATIVE_ATTEMPTS"])
+    return ExecutionProfile(
+        load_balancing_policy=load_balancing_policy(config),
+        consistency_level=ConsistencyLevel.name_to_value[consistency],
+        request_timeout=profile.get("TIMEOUT", 10),
+        speculative_execution_policy=speculative_execution_policy)
+
+
+def cluster_options(config):
+    """Keyword arguments of cassandra.cluster.Cluster for the CASSANDRA
+    section of the configuration, with the execution profiles "default",
+    LOOKUP and SCAN. Entries of PROFILES override the default_profiles
+    key by key."""
+    profiles = {}
+    for (name, defaults) in default_profiles.items():
+        profile = dict(defaults, **config.get("PROFILES", {}).get(name, {}))
+        key = EXEC_PROFILE_DEFAULT if name == "default" else name
+        profiles[key] = execution_profile(config, profile)
+    options = {"execution_profiles": profiles}
+    if config.get("EXECUTOR_THREADS"):
+        options["executor_threads"] = config["EXECUTOR_THREADS"]
+    if config.get("PROTOCOL_VERSION"):
+        options["protocol_version"] = config["PROTOCOL_VERSION"]
+    return options
+
+
+def describe(options):
+    """Settings in effect, one line per execution profile."""
+    lines = ["executor threads: %s, protocol version: %s"
+             % (options.get("executor_threads", "default"),
+                options.get("protocol_version", "negotiated"))]
+    for (name, profile) in options["execution_profiles"].items():
+        policy = profile.load_balancing_policy
+        child = getattr(policy, "_child_policy", policy)
+        speculative = profile.speculative_execution_policy
+        lines.append(
+            "profile %s: %s%s(local_dc=%s), consistency %s, timeout %ss, %s"
+            % ("default" if name is EXEC_PROFILE_DEFAULT else name,
+               "TokenAware/" if child is not policy else "",
+               type(child).__name__, child.local_dc or "auto",
+               ConsistencyLevel.value_to_name[profile.consistency_level],
+               profile.request_timeout,
+               "speculative executions %d after %ss"
+               % (speculative.max_attempts, speculative.delay)
+               if isinstance(speculative, ConstantSpeculativeExecutionPolicy)
+               else "no speculative executions"))
+    return lines
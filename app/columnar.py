@@ -0,0 +1,35 @@
+from flask_restplus import fields
+import fastjson
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MIMETYPE = "application/x-msgpack"
+
+
+def dumps(data):
+    if msgpack is None:
+        raise ImportError("MessagePack responses require the msgpack package")
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def columns(rows, model):
+    """Rows shaped like the response model, as a dict of columns.
+
+    Each field becomes a list of the values of all rows; nested models
+    become nested dicts of columns, e.g. {"address": [...], "balance":
+    {"eur": [...], "satoshi": [...], "usd": [...]}}."""
+    shape = fastjson.shaper(model)
+    return shaped_columns([shape(row) for row in rows], model)
+
+
+def shaped_columns(rows, model):
+    result = {}
+    for (name, field) in model.items():
+        column = [row[name] if row is not None else None for row in rows]
+        if isinstance(field, fields.Nested):
+            column = shaped_columns(column, field.nested)
+        result[name] = column
+    return result
@@ -0,0 +1,68 @@
+import json
+from flask_restplus import fields
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+formats = {
+    fields.Integer: int,
+    fields.Float: float,
+    fields.String: str,
+    fields.Boolean: bool,
+}
+shapers = {}
+
+
+def dumps(data):
+    """Encode data as JSON bytes, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def shaper(model):
+    """Return a function shaping an object or dict the way marshal(obj,
+    model) does, compiled once per model. Supports the field types and
+    options used by the response models; others raise a ValueError."""
+    shape = shapers.get(id(model))
+    if shape is None:
+        shape = shapers[id(model)] = compile_model(model)
+    return shape
+
+
+def compile_model(model):
+    compiled = [(name, compile_field(name, field)) for (name, field) in model.items()]
+
+    def shape(obj):
+        if isinstance(obj, dict):
+            return {name: shape_field(obj.get(name)) for (name, shape_field) in compiled}
+        return {name: shape_field(getattr(obj, name, None)) for (name, shape_field) in compiled}
+    return shape
+
+
+def compile_field(name, field):
+    if isinstance(field, type):
+        field = field()
+    if field.attribute is not None or field.mask is not None:
+        raise ValueError("Field %s: attribute and mask are not supported" % name)
+
+    if isinstance(field, fields.Nested):
+        shape = compile_model(field.nested)
+        if field.allow_null:
+            return lambda value: None if value is None else shape(value)
+        if field.default is not None:
+            return lambda value: field.default if value is None else shape(value)
+        return shape
+
+    if isinstance(field, fields.List):
+        shape_item = compile_field(name, field.container)
+        default = field.default
+        return lambda value: default if value is None else [shape_item(item) for item in value]
+
+    format = formats.get(type(field))
+    if format is None:
+        raise ValueError("Field %s: %s is not supported" % (name, type(field).__name__))
+    default = format(field.default) if field.default else field.default
+    return lambda value: default if value is None else format(value)
@@ -1,7 +1,20 @@
+import copy
+import os
+from collections import deque
+import tempfile
+import threading
+import time
+from functools import partial
 import cassandra.cluster
-from cassandra.query import named_tuple_factory, dict_factory
+from cassandra.concurrent import execute_concurrent_with_args
 from flask import abort
 import graphsensemodel as gm
+import cassandraconfig
+from cassandraconfig import LOOKUP, SCAN
+import ratestore
+import cache
+import metrics
+import searchindex
 
 
 session = None
@@ -18,6 +31,10 @@ address_transactions_without_limit_query = {}
 address_tags_query = {}
 address_search_query = {}
 label_search_query = None
+all_labels_query = None
+label_index = None
+label_index_loaded = 0
+label_index_refresh_interval = 3600
 label_query = None
 transaction_search_query = {}
 address_cluster_query = {}
@@ -35,106 +52,312 @@ cluster_addresses_query = {}
 cluster_addresses_without_limit_query = {}
 block_height_query = {}
 statistics_query = {}
+statistics = {}
+statistics_loaded = 0
+statistics_ttl = 300
+exchange_rates_rebuild_interval = 86400
+max_page_size = 10000
+page_bytes = 1 << 20
+default_page_size = 1000
+min_page_size = 100
+row_sizes = {}
 keyspace_mapping = {}
 all_exchange_rates = {}
 last_height = {}
+caches = {}
+cache_generation = {}
+search_budget = {}
+search_index_dir = None
+search_index_max_lag = 100
+default_data_dir = "/var/lib/graphsense-rest"
+statement_names = {}
+address_index = {}
+transaction_index = {}
+cached_entities = ["address", "cluster", "address_tags", "cluster_tags",
+                   "address_cluster"]
+
+
+def execute_page(entity, statement, params, page_state, pagesize):
+    """Execute one page of statement. The paging parameters are set on a
+    statement bound for this request, never on the shared prepared one.
+    pagesize is capped at max_page_size; without it the page size adapts
+    to the row sizes observed for entity, aiming at page_bytes per page."""
+    bound = statement.bind(params)
+    if pagesize:
+        bound.fetch_size = min(pagesize, max_page_size)
+    else:
+        bound.fetch_size = adaptive_page_size(entity)
+    rows = execute(bound, paging_state=page_state, execution_profile=SCAN)
+    observe_row_size(entity, rows.current_rows)
+    return rows
+
+
+def adaptive_page_size(entity):
+    row_size = row_sizes.get(entity)
+    if not row_size:
+        return default_page_size
+    return max(min_page_size, min(max_page_size, int(page_bytes / row_size)))
+
+
+def observe_row_size(entity, rows, sample=10):
+    """Update the moving average of the size of the rows of entity from
+    the first rows of a page."""
+    if not rows:
+        return
+    sampled = rows[:sample]
+    size = sum(estimate_size(row) for row in sampled) / len(sampled)
+    previous = row_sizes.get(entity)
+    row_sizes[entity] = size if previous is None else 0.8 * previous + 0.2 * size
+
+
+def estimate_size(value):
+    """Approximate encoded size of a row or column value in bytes; rows and
+    user defined types are tuples of their fields."""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    return 8
 
 
 def query_exchange_rates(currency, offset, limit):
+    check_currency(currency)
     if not offset:
         offset = 0
     if not limit:
         limit = 100
     start = last_height[currency] - limit*offset
     end = last_height[currency] - limit*(offset+1)
-    exchange_rates = [gm.ExchangeRate(all_exchange_rates[currency][height]).__dict__
-                      for height in range(start, end, -1)]
-    return exchange_rates
+    if start < 0:
+        return []
+    rates = all_exchange_rates[currency].rates
+    rates = rates[start:end:-1] if end >= 0 else rates[start::-1]
+    return [{"eur": eur, "usd": usd} for (eur, usd) in rates.tolist()]
+
+
+def query_exchange_rate_columns(currency, from_height, to_height, step):
+    check_currency(currency)
+    to_height = min(to_height, last_height[currency])
+    rates = all_exchange_rates[currency].rates[from_height:to_height+1:step]
+    return rates[:, ratestore.EUR], rates[:, ratestore.USD]
 
 
 def query_block(currency, height):
-    set_keyspace(session, currency, space="raw")
+    check_currency(currency)
     if height > last_height[currency]:
         abort(404, "Block not available yet")
-    result = session.execute(block_query[currency], [height])
-    return gm.Block(result[0]).__dict__ if result else None
+    result = execute(block_query[currency], [height], execution_profile=LOOKUP)
+    return gm.Block(result[0]) if result else None
+
+
+def query_statistics_async(currency):
+    check_currency(currency)
+    return query_async(statistics_query[currency], [],
+                       lambda result: gm.Statistics(result[0]).to_dict() if result else None)
 
 
 def query_statistics(currency):
-    set_keyspace(session, currency)
-    result = session.execute(statistics_query[currency])
-    return gm.Statistics(result[0]).__dict__ if result else None
+    return query_statistics_async(currency)()
 
 
 def query_block_transactions(currency, height):
-    set_keyspace(session, currency, space="raw")
+    check_currency(currency)
     if height > last_height[currency]:
         abort(404, "Block not available yet")
-    result = session.execute(block_transactions_query[currency], [height])
-    return gm.BlockWithTransactions(result[0], query_exchange_rate_for_height(currency, height)).__dict__ if result else None
+    result = execute(block_transactions_query[currency], [height], execution_profile=LOOKUP)
+    return gm.BlockWithTransactions(result[0], query_exchange_rates_for_heights(currency, [height])[0]) if result else None
 
 
 def query_blocks(currency, page_state):
-    set_keyspace(session, currency, space="raw")
+    check_currency(currency)
     if page_state:
-        results = session.execute(blocks_query[currency], paging_state=page_state)
+        results = execute(blocks_query[currency], paging_state=page_state)
     else:
-        results = session.execute(blocks_query[currency], [10])
+        results = execute(blocks_query[currency], [10])
     page_state = results.paging_state
-    blocks = [gm.Block(row).__dict__ for row in results]
+    blocks = [gm.Block(row) for row in results]
     return page_state, blocks
 
 
 def query_transaction(currency, txHash):
-    set_keyspace(session, currency, space="raw")
+    check_currency(currency)
     try:
-        rows = session.execute(tx_query[currency], [txHash[0:5], bytearray.fromhex(txHash)])
+        rows = execute(tx_query[currency], [txHash[0:5], bytearray.fromhex(txHash)],
+                               execution_profile=LOOKUP)
     except Exception:
         abort(404, "Transaction hash is not hex")
-    return gm.Transaction(rows[0], query_exchange_rate_for_height(currency, rows[0].height)).__dict__ if rows else None
+    return query_transaction_models(currency, rows[:1])[0] if rows else None
+
+
+def query_transactions_by_hash(currency, tx_hashes):
+    """Return {tx_hash: transaction, None or the exception of a failed
+    query} for a list of hex tx hashes."""
+    check_currency(currency)
+    rows = query_concurrently(tx_query[currency],
+                              [(tx_hash[0:5], bytearray.fromhex(tx_hash)) for tx_hash in tx_hashes],
+                              raise_on_first_error=False)
+    failed = {tx_hash: tx_rows for (tx_hash, tx_rows) in zip(tx_hashes, rows)
+              if isinstance(tx_rows, Exception)}
+    found = [(tx_hash, tx_rows[0]) for (tx_hash, tx_rows) in zip(tx_hashes, rows)
+             if tx_hash not in failed and tx_rows]
+    transactions = dict.fromkeys(tx_hashes)
+    transactions.update(failed)
+    transactions.update(zip([tx_hash for (tx_hash, _) in found],
+                            query_transaction_models(currency, [row for (_, row) in found])))
+    return transactions
 
 
 def query_transactions(currency, page_state):
-    set_keyspace(session, currency, space="raw")
+    check_currency(currency)
     if page_state:
-        results = session.execute(txs_query[currency], paging_state=page_state)
+        results = execute(txs_query[currency], paging_state=page_state)
     else:
-        results = session.execute(txs_query[currency], [10])
+        results = execute(txs_query[currency], [10])
 
     page_state = results.paging_state
-    transactions = [gm.Transaction(row, query_exchange_rate_for_height(currency, row.height)).__dict__
-                    for row in results]
+    transactions = query_transaction_models(currency, list(results))
     return page_state, transactions
 
 
+def query_transaction_models(currency, rows):
+    """Transactions of rows, valued at the exchange rates of their heights
+    in one pass."""
+    return gm.transactions(rows, query_exchange_rates_for_heights(
+        currency, [row.height for row in rows]))
+
+
 def query_transaction_search(currency, expression):
-    set_keyspace(session, currency, space="raw")
-    transactions = session.execute(transaction_search_query[currency],
+    check_currency(currency)
+    transactions = execute(transaction_search_query[currency],
                                    [expression])
     transactions._fetch_all()
     return transactions
 
 
 def query_address_search(currency, expression):
-    set_keyspace(session, currency)
-    addresses = session.execute(address_search_query[currency], [expression])
+    check_currency(currency)
+    addresses = execute(address_search_query[currency], [expression])
     addresses._fetch_all()
     return addresses
 
 
+def search_addresses(currency, expression, limit):
+    """Return up to limit addresses starting with expression, from the
+    prefix index if it was built, otherwise from Cassandra."""
+    check_currency(currency)
+    index = current_index(address_index.get(currency), transformed_height(currency))
+    if index is not None:
+        return index.search(expression, limit)
+    addresses = query_address_search(currency, expression[0:5])
+    return [row.address for row in addresses.current_rows
+            if row.address.startswith(expression)][:limit]
+
+
+def search_transactions(currency, expression, limit):
+    """Return up to limit hex tx hashes starting with expression, from the
+    prefix index if it was built, otherwise from Cassandra."""
+    check_currency(currency)
+    index = current_index(transaction_index.get(currency), last_height[currency])
+    if index is not None:
+        return index.search(expression, limit)
+    transactions = query_transaction_search(currency, expression[0:5])
+    return [tx_hash for tx_hash in (row.tx_hash.hex() for row in transactions.current_rows)
+            if tx_hash.startswith(expression)][:limit]
+
+
+def open_search_indices(currency):
+    (raw, transformed) = keyspace_mapping[currency]
+    address_index[currency] = searchindex.open_index(search_index_dir, "%s.address" % transformed)
+    transaction_index[currency] = searchindex.open_index(search_index_dir, "%s.transaction" % raw)
+
+
+def transformed_height(currency):
+    """Height of the last block in the transformed keyspace of currency."""
+    return max((statistics.get(currency) or {}).get("no_blocks", 0) - 1, 0)
+
+
+def current_index(index, h_max):
+    """index, unless it lags more than search_index_max_lag blocks behind
+    h_max and has to be rebuilt."""
+    if index is not None and h_max - index.height <= search_index_max_lag:
+        return index
+    return None
+
+
+def extend_search_index(index, h_max, load):
+    """Add the keys load(heights) of the blocks above the height of index
+    up to h_max, unless it lags too far behind to be used."""
+    if index is None or not index.height < h_max <= index.height + search_index_max_lag:
+        return
+    index.extend(load(range(index.height + 1, h_max + 1)), h_max)
+
+
+def query_blocks_tx_hashes(currency, heights):
+    rows = query_concurrently(block_transactions_query[currency],
+                              [(height,) for height in heights])
+    return [tx.tx_hash.hex() for block_rows in rows
+            for block in block_rows for tx in block.txs]
+
+
+def query_blocks_output_addresses(currency, heights):
+    # addresses first appear as outputs
+    rows = query_concurrently(tx_query[currency],
+                              [(tx_hash[0:5], bytearray.fromhex(tx_hash))
+                               for tx_hash in query_blocks_tx_hashes(currency, heights)])
+    return [output.address[0] for tx_rows in rows
+            for tx in tx_rows for output in tx.outputs if output.address]
+
+
+def refresh_search_indices():
+    for currency in list(address_index.keys()):
+        if address_index[currency] is None or transaction_index[currency] is None:
+            open_search_indices(currency)
+        for index in (address_index[currency], transaction_index[currency]):
+            if index is not None:
+                index.reload_if_changed()
+        extend_search_index(address_index[currency], transformed_height(currency),
+                            partial(query_blocks_output_addresses, currency))
+        extend_search_index(transaction_index[currency], last_height[currency],
+                            partial(query_blocks_tx_hashes, currency))
+
+
+def search_labels(expression_norm, limit):
+    """Return up to limit labels whose normalized label starts with
+    expression_norm, from the label index if it is loaded, otherwise from
+    Cassandra."""
+    if label_index is not None:
+        return label_index.search(expression_norm, limit)
+    labels = query_label_search(expression_norm[0:3])
+    return list(dict.fromkeys(
+        [row.label for row in labels.current_rows if row.label_norm.startswith(expression_norm)][:limit]))
+
+
+def load_label_index():
+    global label_index, label_index_loaded
+    statement = all_labels_query.bind([])
+    statement.fetch_size = 5000
+    rows = execute(statement, execution_profile=SCAN)
+    label_index = searchindex.LabelIndex(
+        (row.label_norm, row.label, row.address_count) for row in rows)
+    label_index_loaded = time.monotonic()
+
+
+def refresh_label_index():
+    if time.monotonic() - label_index_loaded >= label_index_refresh_interval:
+        load_label_index()
+
+
 def query_label_search(expression_norm_prefix):
-    set_keyspace(session, "", space="tagpacks")
-    labels = session.execute(label_search_query, [expression_norm_prefix])
+    labels = execute(label_search_query, [expression_norm_prefix])
     labels._fetch_all()
     return labels
 
 
 def query_tags(label_norm_prefix, label_norm):
-    set_keyspace(session, "", space="tagpacks")
-    labels = session.execute(tags_query, [label_norm_prefix, label_norm])
+    labels = execute(tags_query, [label_norm_prefix, label_norm])
     labels._fetch_all()
     def makeTagWithCurrency(row):
-        d = gm.Tag(row).__dict__
+        d = gm.Tag(row).to_dict()
         d["currency"] = row.currency
         return d
 
@@ -142,35 +365,198 @@ def query_tags(label_norm_prefix, label_norm):
     return tags
 
 def query_label(label_norm_prefix, label_norm):
-    set_keyspace(session, "", space="tagpacks")
-    label = session.execute(label_query, [label_norm_prefix, label_norm])
-    return gm.Label(label[0]).__dict__ if label else None
+    label = execute(label_query, [label_norm_prefix, label_norm])
+    return gm.Label(label[0]).to_dict() if label else None
+
+def cache_key(currency, key):
+    return "%s:%s:%s" % (currency, cache_generation.get(currency), key)
+
+
+def execute_async(statement, params=None, **options):
+    """session.execute_async, recording the latency and rows of the
+    statement for /metrics."""
+    future = session.execute_async(statement, params, **options)
+    prepared = getattr(statement, "prepared_statement", statement)
+    metrics.observe_query(statement_names.get(id(prepared), "other"), future)
+    return future
+
+
+def execute(statement, params=None, **options):
+    return execute_async(statement, params, **options).result()
+
+
+def query_async(statement, params, convert):
+    """Start executing statement and return a function that waits for the
+    result and returns convert(rows). Independent queries are started
+    first and joined afterwards, so they take one round trip together."""
+    future = execute_async(statement, params, execution_profile=LOOKUP)
+    return lambda: convert(future.result())
+
+
+def cached_async(entity, currency, key, statement, params, convert):
+    """Like query_async, but through the cache of entity, if it is cached."""
+    entity_cache = caches.get(entity)
+    if entity_cache is None:
+        return query_async(statement, params, convert)
+    value = entity_cache.get(cache_key(currency, key))
+    if value is not cache.MISSING:
+        return lambda: value
+
+    def store(rows):
+        value = convert(rows)
+        entity_cache.set(cache_key(currency, key), value)
+        return value
+    return query_async(statement, params, store)
+
+
+def join(*pending):
+    return [result() for result in pending]
+
+
+def cached_many(entity, currency, keys, load):
+    """Return {key: value} for keys, where load(missing_keys) returns the
+    values of the keys not found in the cache of entity."""
+    entity_cache = caches.get(entity)
+    if entity_cache is None:
+        return load(keys)
+    values = {}
+    missing = []
+    for key in keys:
+        value = entity_cache.get(cache_key(currency, key))
+        if value is cache.MISSING:
+            missing.append(key)
+        else:
+            values[key] = value
+    if missing:
+        loaded = load(missing)
+        for (key, value) in loaded.items():
+            # failed queries are retried by the next request
+            if not isinstance(value, Exception):
+                entity_cache.set(cache_key(currency, key), value)
+        values.update(loaded)
+    return values
+
+
+def query_concurrently(statement, params_list, raise_on_first_error=True,
+                       deadline=None, concurrency=100):
+    """Execute statement once per parameter list with concurrent requests
+    and return the rows of each execution, in the order of params_list.
+    Without raise_on_first_error, a failed execution returns its
+    exception instead of rows.
+
+    With a deadline (of time.monotonic()), every execution times out at
+    the deadline and none is started after it; those fail with a
+    TimeoutError."""
+    if deadline is None:
+        results = execute_concurrent_with_args(session, statement, params_list,
+                                               raise_on_first_error=raise_on_first_error)
+        return [list(rows) if success else rows for (success, rows) in results]
+
+    def outcome(future):
+        try:
+            return list(future.result())
+        except Exception as e:
+            if raise_on_first_error:
+                raise
+            return e
+    results = []
+    futures = deque()
+    for params in params_list:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if len(futures) >= concurrency:
+            results.append(outcome(futures.popleft()))
+        futures.append(execute_async(statement, params, timeout=remaining))
+    results.extend(outcome(future) for future in futures)
+    if len(results) < len(params_list) and raise_on_first_error:
+        raise TimeoutError("Deadline exceeded")
+    results.extend(TimeoutError("Deadline exceeded")
+                   for _ in range(len(params_list) - len(results)))
+    return results
+
+
+def cache_stats():
+    return {entity: {"hits": entity_cache.hits,
+                     "misses": entity_cache.misses,
+                     "size": len(entity_cache)}
+            for (entity, entity_cache) in caches.items()}
+
+
+def query_address_async(currency, address):
+    check_currency(currency)
+    exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
+    pending = cached_async("address", currency, address,
+                           address_query[currency], [address, address[0:5]],
+                           lambda rows: gm.Address(rows[0], exchange_rate) if rows else None)
+    # callers attach tags, so hand out a copy of the cached object
+    return lambda: copy.copy(pending())
+
 
 def query_address(currency, address):
-    set_keyspace(session, currency)
-    rows = session.execute(address_query[currency], [address, address[0:5]])
-    return gm.Address(rows[0], gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])) if rows else None
+    return query_address_async(currency, address)()
+
+
+def query_addresses(currency, addresses, deadline=None):
+    """Return {address: gm.Address, None or the exception of a failed
+    query} for a list of addresses."""
+    check_currency(currency)
+
+    def load(missing):
+        exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
+        rows = query_concurrently(address_query[currency],
+                                  [(address, address[0:5]) for address in missing],
+                                  raise_on_first_error=False, deadline=deadline)
+        return {address: address_rows if isinstance(address_rows, Exception)
+                else gm.Address(address_rows[0], exchange_rate) if address_rows else None
+                for (address, address_rows) in zip(missing, rows)}
+    return {address: copy.copy(address_obj) for (address, address_obj)
+            in cached_many("address", currency, addresses, load).items()}
 
 
 def query_address_cluster(currency, address):
-    set_keyspace(session, currency)
+    check_currency(currency)
     clusterid = query_address_cluster_id(currency, address)
     ret = {}
     if clusterid:
         cluster_obj = query_cluster(currency, clusterid)
-        ret = cluster_obj.__dict__
+        ret = cluster_obj.to_dict()
+    return ret
+
+
+def query_address_cluster_with_tags(currency, address):
+    check_currency(currency)
+    clusterid = query_address_cluster_id(currency, address)
+    ret = {}
+    if clusterid:
+        (cluster_obj, tags) = join(query_cluster_async(currency, clusterid),
+                                   query_cluster_tags_async(currency, clusterid))
+        if cluster_obj:
+            ret = cluster_obj.to_dict()
+            ret["tags"] = tags
     return ret
 
+
 def query_address_cluster_id(currency, address):
-    set_keyspace(session, currency)
-    clusterids = session.execute(address_cluster_query[currency],
-                                 [address, address[0:5]])
-    if clusterids:
-        return clusterids[0].cluster
-    return None
+    check_currency(currency)
+    return cached_async("address_cluster", currency, address,
+                        address_cluster_query[currency], [address, address[0:5]],
+                        lambda clusterids: clusterids[0].cluster if clusterids else None)()
+
+
+def query_address_cluster_ids(currency, addresses):
+    """Return {address: cluster id or None} for a list of addresses."""
+    check_currency(currency)
+
+    def load(missing):
+        rows = query_concurrently(address_cluster_query[currency],
+                                  [(address, address[0:5]) for address in missing])
+        return {address: clusterids[0].cluster if clusterids else None
+                for (address, clusterids) in zip(missing, rows)}
+    return cached_many("address_cluster", currency, addresses, load)
 
 def query_address_transactions(currency, page_state, address, pagesize, limit):
-    set_keyspace(session, currency)
+    check_currency(currency)
 
     if limit is None:
         query = address_transactions_without_limit_query
@@ -179,31 +565,54 @@ def query_address_transactions(currency, page_state, address, pagesize, limit):
         query = address_transactions_query
         params = [address, address[0:5], limit]
 
-    if pagesize:
-        query[currency].fetch_size = pagesize
-
-    if page_state:
-        rows = session.execute(query[currency], params, paging_state=page_state)
-    else:
-        rows = session.execute(query[currency], params)
+    rows = execute_page("address_transactions", query[currency], params, page_state, pagesize)
 
     page_state = rows.paging_state
-    return page_state, [row for row in rows.current_rows]
+    rows = rows.current_rows
+    return page_state, gm.address_transactions(rows, query_exchange_rates_for_heights(
+        currency, [row.height for row in rows]))
+
+
+def query_address_tags_async(currency, address):
+    check_currency(currency)
+    pending = cached_async("address_tags", currency, address,
+                           address_tags_query[currency], [address],
+                           lambda tags: [gm.Tag(row).to_dict() for row in tags])
+    return lambda: list(pending())
 
 
 def query_address_tags(currency, address):
-    set_keyspace(session, currency)
-    tags = session.execute(address_tags_query[currency], [address])
-    return [gm.Tag(row).__dict__ for row in tags]
+    return query_address_tags_async(currency, address)()
+
+
+def query_addresses_tags(currency, addresses, deadline=None):
+    """Return {address: list of tags or the exception of a failed query}
+    for a list of addresses."""
+    check_currency(currency)
+
+    def load(missing):
+        rows = query_concurrently(address_tags_query[currency],
+                                  [(address,) for address in missing],
+                                  raise_on_first_error=False, deadline=deadline)
+        return {address: tag_rows if isinstance(tag_rows, Exception)
+                else [gm.Tag(row).to_dict() for row in tag_rows]
+                for (address, tag_rows) in zip(missing, rows)}
+    return {address: tags if isinstance(tags, Exception) else list(tags)
+            for (address, tags)
+            in cached_many("address_tags", currency, addresses, load).items()}
+
 
 def query_address_with_tags(currency, address):
-    result = query_address(currency, address)
-    result.tags = query_address_tags(currency, address)
+    (result, tags) = join(query_address_async(currency, address),
+                          query_address_tags_async(currency, address))
+    if result:
+        result.tags = tags
     return result
 
+
 def query_implicit_tags(currency, address):
-    set_keyspace(session, currency)
-    clusters = session.execute(address_cluster_query[currency], [address, address[0:5]])
+    check_currency(currency)
+    clusters = execute(address_cluster_query[currency], [address, address[0:5]])
     implicit_tags = []
     for (clusterrow) in clusters:
         clustertags = query_cluster_tags(currency, clusterrow.cluster)
@@ -213,7 +622,7 @@ def query_implicit_tags(currency, address):
 
 
 def query_address_incoming_relations(currency, page_state, address, pagesize, limit):
-    set_keyspace(session, currency)
+    check_currency(currency)
     if limit is None:
         query = address_incoming_relations_without_limit_query
         params = [address[0:5], address]
@@ -221,13 +630,7 @@ def query_address_incoming_relations(currency, page_state, address, pagesize, li
         query = address_incoming_relations_query
         params = [address[0:5], address, limit]
 
-    if pagesize:
-        query[currency].fetch_size = pagesize
-
-    if page_state:
-        rows = session.execute(query[currency], params, paging_state=page_state)
-    else:
-        rows = session.execute(query[currency], params)
+    rows = execute_page("address_incoming_relations", query[currency], params, page_state, pagesize)
 
     page_state = rows.paging_state
     exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
@@ -237,7 +640,7 @@ def query_address_incoming_relations(currency, page_state, address, pagesize, li
 
 
 def query_address_outgoing_relations(currency, page_state, address, pagesize, limit):
-    set_keyspace(session, currency)
+    check_currency(currency)
     if limit is None:
         query = address_outgoing_relations_without_limit_query
         params = [address[0:5], address]
@@ -245,13 +648,7 @@ def query_address_outgoing_relations(currency, page_state, address, pagesize, li
         query = address_outgoing_relations_query
         params = [address[0:5], address, limit]
 
-    if pagesize is not None:
-        query[currency].fetch_size = pagesize
-
-    if page_state is not None:
-        rows = session.execute(query[currency], params, paging_state=page_state)
-    else:
-        rows = session.execute(query[currency], params)
+    rows = execute_page("address_outgoing_relations", query[currency], params, page_state, pagesize)
 
     page_state = rows.paging_state
     exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
@@ -260,22 +657,80 @@ def query_address_outgoing_relations(currency, page_state, address, pagesize, li
     return page_state, relations
 
 
+def query_cluster_async(currency, cluster):
+    check_currency(currency)
+    cluster = int(cluster)
+    exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
+    pending = cached_async("cluster", currency, cluster,
+                           cluster_query[currency], [cluster],
+                           lambda rows: gm.Cluster(rows.current_rows[0], exchange_rate) if rows else None)
+    # callers attach tags, so hand out a copy of the cached object
+    return lambda: copy.copy(pending())
+
+
 def query_cluster(currency, cluster):
-    set_keyspace(session, currency)
-    rows = session.execute(cluster_query[currency], [int(cluster)])
-    return gm.Cluster(rows.current_rows[0],
-                      gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])) if rows else None
+    return query_cluster_async(currency, cluster)()
+
+
+def query_cluster_with_tags(currency, cluster):
+    (cluster_obj, tags) = join(query_cluster_async(currency, cluster),
+                               query_cluster_tags_async(currency, cluster))
+    if cluster_obj:
+        cluster_obj.tags = tags
+    return cluster_obj
+
+
+def query_cluster_tags_async(currency, cluster):
+    check_currency(currency)
+    cluster = int(cluster)
+    pending = cached_async("cluster_tags", currency, cluster,
+                           cluster_tags_query[currency], [cluster],
+                           lambda tags: [gm.Tag(tagrow).to_dict() for (tagrow) in tags])
+    return lambda: list(pending())
 
 
 def query_cluster_tags(currency, cluster):
-    set_keyspace(session, currency)
-    tags = session.execute(cluster_tags_query[currency], [int(cluster)])
-    clustertags = [gm.Tag(tagrow).__dict__ for (tagrow) in tags]
-    return clustertags
+    return query_cluster_tags_async(currency, cluster)()
+
+
+def query_clusters(currency, clusters, deadline=None):
+    """Return {cluster: gm.Cluster, None or the exception of a failed
+    query} for a list of cluster ids."""
+    check_currency(currency)
+
+    def load(missing):
+        exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
+        rows = query_concurrently(cluster_query[currency],
+                                  [(cluster,) for cluster in missing],
+                                  raise_on_first_error=False, deadline=deadline)
+        return {cluster: cluster_rows if isinstance(cluster_rows, Exception)
+                else gm.Cluster(cluster_rows[0], exchange_rate) if cluster_rows else None
+                for (cluster, cluster_rows) in zip(missing, rows)}
+    clusters = [int(cluster) for cluster in clusters]
+    return {cluster: copy.copy(cluster_obj) for (cluster, cluster_obj)
+            in cached_many("cluster", currency, clusters, load).items()}
+
+
+def query_clusters_tags(currency, clusters, deadline=None):
+    """Return {cluster: list of tags or the exception of a failed query}
+    for a list of cluster ids."""
+    check_currency(currency)
+
+    def load(missing):
+        rows = query_concurrently(cluster_tags_query[currency],
+                                  [(cluster,) for cluster in missing],
+                                  raise_on_first_error=False, deadline=deadline)
+        return {cluster: tag_rows if isinstance(tag_rows, Exception)
+                else [gm.Tag(tagrow).to_dict() for tagrow in tag_rows]
+                for (cluster, tag_rows) in zip(missing, rows)}
+    clusters = [int(cluster) for cluster in clusters]
+    return {cluster: tags if isinstance(tags, Exception) else list(tags)
+            for (cluster, tags)
+            in cached_many("cluster_tags", currency, clusters, load).items()}
 
 
 def query_cluster_addresses(currency, cluster, page, pagesize, limit):
-    set_keyspace(session, currency)
+    check_currency(currency)
     if limit is None:
         query = cluster_addresses_without_limit_query
         params = [int(cluster)]
@@ -283,22 +738,17 @@ def query_cluster_addresses(currency, cluster, page, pagesize, limit):
         query = cluster_addresses_query
         params = [int(cluster), limit]
 
-    if pagesize is not None:
-        query[currency].fetch_size = pagesize
-
-    if page:
-        rows = session.execute(query[currency], params, paging_state=page)
-    else:
-        rows = session.execute(query[currency], params)
+    rows = execute_page("cluster_addresses", query[currency], params, page, pagesize)
 
-    clusteraddresses = [gm.ClusterAddresses(row, gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])).__dict__
+    exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
+    clusteraddresses = [gm.ClusterAddresses(row, exchange_rate)
                         for row in rows.current_rows]
     page = rows.paging_state
     return page, clusteraddresses
 
 
 def query_cluster_incoming_relations(currency, page_state, cluster, pagesize, limit):
-    set_keyspace(session, currency)
+    check_currency(currency)
     if limit is None:
         query = cluster_incoming_relations_without_limit_query
         params = [cluster]
@@ -306,13 +756,7 @@ def query_cluster_incoming_relations(currency, page_state, cluster, pagesize, li
         query = cluster_incoming_relations_query
         params = [cluster, limit]
 
-    if pagesize:
-        query[currency].fetch_size = pagesize
-
-    if page_state:
-        rows = session.execute(query[currency], params, paging_state=page_state)
-    else:
-        rows = session.execute(query[currency], params)
+    rows = execute_page("cluster_incoming_relations", query[currency], params, page_state, pagesize)
 
     page_state = rows.paging_state
     exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
@@ -321,7 +765,7 @@ def query_cluster_incoming_relations(currency, page_state, cluster, pagesize, li
 
 
 def query_cluster_outgoing_relations(currency, page_state, cluster, pagesize, limit):
-    set_keyspace(session, currency)
+    check_currency(currency)
     if limit is None:
         query = cluster_outgoing_relations_without_limit_query
         params = [cluster]
@@ -329,127 +773,358 @@ def query_cluster_outgoing_relations(currency, page_state, cluster, pagesize, li
         query = cluster_outgoing_relations_query
         params = [cluster, limit]
 
-    if pagesize:
-        query[currency].fetch_size = pagesize
-
-    if page_state:
-        rows = session.execute(query[currency], params, paging_state=page_state)
-    else:
-        rows = session.execute(query[currency], params)
+    rows = execute_page("cluster_outgoing_relations", query[currency], params, page_state, pagesize)
     page_state = rows.paging_state
     exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
     relations = [gm.ClusterOutgoingRelations(row, exchange_rate) for row in rows.current_rows]
     return page_state, relations
 
 def query_cluster_search_neighbors(currency, cluster, isOutgoing, category, ids, breadth, depth):
-    set_keyspace(session, currency)
-    if depth <= 0:
-        return []
-
-
+    """Search paths of up to depth relations from cluster to clusters with
+    a tag of category and/or containing one of the addresses in ids.
+
+    The graph is expanded breadth first, one level per round of concurrent
+    queries, and every cluster is expanded at most once. The paths are
+    then assembled from the fetched relations, sharing the paths of a
+    cluster between all paths leading to it.
+
+    Every query of the search, including those for the clusters and
+    matching addresses on the paths, counts against the SEARCH_BUDGET of
+    queries and times out at its deadline; the expansion also stops at the
+    budget of expanded clusters. Returns the paths and whether they were
+    truncated by the budget."""
+    check_currency(currency)
     if isOutgoing:
-        (_, rows) = query_cluster_outgoing_relations(currency, None, cluster, breadth, breadth)
+        relations_query = cluster_outgoing_relations_query[currency]
+        relation_type = gm.ClusterOutgoingRelations
     else:
-        (_, rows) = query_cluster_incoming_relations(currency, None, cluster, breadth, breadth)
+        relations_query = cluster_incoming_relations_query[currency]
+        relation_type = gm.ClusterIncomingRelations
+    exchange_rate = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
+
+    def neighbor(relation):
+        return relation.dstCluster if isOutgoing else relation.srcCluster
+
+    relations = {}  # expanded cluster -> relations to its neighbors
+    tags = {}  # neighbor cluster -> tags
+    matchingAddresses = {}  # neighbor cluster -> matching addresses, if it matches
+    max_expanded = search_budget.get("MAX_EXPANDED", 10000)
+    max_queries = search_budget.get("MAX_QUERIES", 20000)
+    deadline = time.monotonic() + search_budget.get("TIMEOUT", 30)
+    queries = 0
+    truncated = False
+
+    def within_budget(keys, cost=1):
+        # the keys whose cost queries fit into the remaining budget
+        nonlocal queries, truncated
+        allowed = max(max_queries - queries, 0) // cost
+        if time.monotonic() > deadline:
+            allowed = 0
+        if len(keys) > allowed:
+            keys = keys[:allowed]
+            truncated = True
+        queries += len(keys) * cost
+        return keys
+
+    frontier = [str(cluster)]
+    for level in range(depth):
+        allowed = max(max_expanded - len(relations), 0)
+        if len(frontier) > allowed:
+            frontier = frontier[:allowed]
+            truncated = True
+        frontier = within_budget(frontier)
+        if not frontier:
+            break
+        rows = query_concurrently(relations_query,
+                                  [(expanded, breadth) for expanded in frontier],
+                                  raise_on_first_error=False, deadline=deadline)
+        neighbors = []
+        for (expanded, relation_rows) in zip(frontier, rows):
+            if isinstance(relation_rows, Exception):
+                truncated = True
+                continue
+            relations[expanded] = [relation_type(row, exchange_rate) for row in relation_rows]
+            neighbors.extend(neighbor(relation) for relation in relations[expanded])
+        # neighbors without tags are left out of the paths
+        neighbors = within_budget([subcluster for subcluster in dict.fromkeys(neighbors)
+                                   if subcluster.isdigit() and subcluster not in tags])
+        for (subcluster, subcluster_tags) in query_clusters_tags(currency, neighbors, deadline).items():
+            if isinstance(subcluster_tags, Exception):
+                truncated = True
+            else:
+                tags[str(subcluster)] = subcluster_tags
+
+        frontier = []
+        for subcluster in neighbors:
+            if subcluster not in tags:
+                continue
+            match = True
+            if category != None:
+                # find first occurence of category in tags
+                match = next((True for t in tags[subcluster] if t["category"] == category), False)
+            addresses = []
+            if match and ids != None:
+                addresses = [id["address"] for id in ids if str(id["cluster"]) == subcluster]
+                match = len(addresses) > 0
+            if match:
+                matchingAddresses[subcluster] = addresses
+            elif subcluster not in relations:
+                frontier.append(subcluster)
+        if not frontier:
+            break
+
+    memo = {}
+    nodes = set()
+
+    def search_paths(expanded, remaining):
+        if remaining <= 0 or expanded not in relations:
+            return []
+        if (expanded, remaining) in memo:
+            return memo[(expanded, remaining)]
+        paths = []
+        for relation in relations[expanded]:
+            subcluster = neighbor(relation)
+            # clusters whose tags were not fetched within the budget,
+            # e.g. the root on a cycle, are left out
+            if not subcluster.isdigit() or subcluster not in tags:
+                continue
+            if subcluster in matchingAddresses:
+                subpaths = True
+            else:
+                subpaths = search_paths(subcluster, remaining - 1)
+            if not subpaths:
+                continue
+            nodes.add(subcluster)
+            paths.append((subcluster, relation, subpaths))
+        memo[(expanded, remaining)] = paths
+        return paths
+
+    root_paths = search_paths(str(cluster), depth)
+
+    # clusters and addresses beyond the budget are returned without details
+    clusters = query_clusters(currency, within_budget(sorted(nodes)), deadline)
+    props = {}
+    for subcluster in nodes:
+        cluster_obj = clusters.get(int(subcluster))
+        if isinstance(cluster_obj, Exception):
+            truncated = True
+        if cluster_obj and not isinstance(cluster_obj, Exception):
+            props[subcluster] = cluster_obj.to_dict()
+        else:
+            props[subcluster] = {"cluster": int(subcluster)}
+        props[subcluster]["tags"] = tags[subcluster]
+
+    addresses = within_budget(list(dict.fromkeys(
+        address for subcluster in sorted(nodes)
+        for address in matchingAddresses.get(subcluster, []))), cost=2)
+    address_objs = query_addresses(currency, addresses, deadline)
+    address_tags = query_addresses_tags(currency, addresses, deadline)
+    addresses_with_tags = {}
+    for address in addresses:
+        (address_obj, tags_of_address) = (address_objs[address], address_tags[address])
+        if isinstance(address_obj, Exception) or isinstance(tags_of_address, Exception):
+            truncated = True
+        elif address_obj is not None:
+            address_obj.tags = tags_of_address
+            addresses_with_tags[address] = address_obj
+    json_paths = {}
+
+    def to_json(paths):
+        # subtrees shared through memo are converted only once
+        if id(paths) in json_paths:
+            return json_paths[id(paths)]
+        result = []
+        for (subcluster, relation, subpaths) in paths:
+            obj = {"node": props[subcluster], "relation": relation.toJson(), "matchingAddresses": []}
+            if subpaths == True:
+                obj["matchingAddresses"] = [addresses_with_tags[address]
+                                            for address in matchingAddresses[subcluster]
+                                            if address in addresses_with_tags]
+                subpaths = None
+            else:
+                subpaths = to_json(subpaths)
+            obj["paths"] = subpaths
+            result.append(obj)
+        json_paths[id(paths)] = result
+        return result
 
-    paths = []
+    return to_json(root_paths), truncated
 
-    for row in rows:
-        subcluster = row.dstCluster if isOutgoing else row.srcCluster
-        if not subcluster.isdigit():
-            continue
-        match = True
-        tags = query_cluster_tags(currency, subcluster)
 
-        if category != None:
-            # find first occurence of category in tags
-            match = next((True for t in tags if t["category"] == category), False)
+def query_all_statistics():
+    pending = {currency: query_statistics_async(currency)
+               for currency in keyspace_mapping.keys() if currency != "tagpacks"}
+    return {currency: result() for (currency, result) in pending.items()}
 
-        matchingAddresses = []
-        if match and ids != None:
-            matchingAddresses = [id["address"] for id in ids if str(id["cluster"]) == str(subcluster)]
-            match = len(matchingAddresses) > 0
 
-        if match:
-            subpaths = True
-        else:
-            subpaths = query_cluster_search_neighbors(currency, subcluster, isOutgoing, category, ids, breadth, depth - 1)
+def load_statistics():
+    global statistics, statistics_loaded
+    statistics = query_all_statistics()
+    statistics_loaded = time.monotonic()
 
-        if not subpaths:
-            continue
-        props = query_cluster(currency, subcluster).__dict__
-        props["tags"] = tags
-        obj = {"node": props, "relation": row.toJson(), "matchingAddresses": []}
-        if subpaths == True:
-            addresses_with_tags = [ query_address_with_tags(currency, address) for address in matchingAddresses ]
-            obj["matchingAddresses"] = [ address for address in addresses_with_tags if address is not None ]
-            subpaths = None
-        obj["paths"] = subpaths
-        paths.append(obj)
-    return paths
-
-def set_keyspace(session, currency=None, space="transformed"):
-    if space == "tagpacks":
-        session.set_keyspace(keyspace_mapping["tagpacks"])
-        return
 
-    if currency in keyspace_mapping:
-        if space == "raw":
-            session.set_keyspace(keyspace_mapping[currency][0])
-        elif space == "transformed":
-            session.set_keyspace(keyspace_mapping[currency][1])
-        else:
-            abort(404, "Keyspace %s not allowed" % space)
-    else:
+def cached_statistics():
+    """Statistics of all currencies as last loaded by the refresher; they
+    are only queried here if the refresher fell behind statistics_ttl."""
+    if time.monotonic() - statistics_loaded >= statistics_ttl:
+        load_statistics()
+    return statistics
+
+
+def check_currency(currency):
+    if currency not in keyspace_mapping or currency == "tagpacks":
         abort(404, "Currency %s does not exist" % currency)
 
 
 def query_all_exchange_rates(currency, h_max):
-    try:
-        set_keyspace(session, currency, space="raw")
-        session.row_factory = dict_factory
-        session.default_fetch_size = None
-        print("Loading exchange rates for %s ..." % currency)
-        results = session.execute(exchange_rates_query[currency], [h_max],
-                                  timeout=180)
-        d = {row["height"]: {"eur": row["eur"], "usd": row["usd"]}
-             for row in results}
-        print("Rates loaded.")
-        session.row_factory = named_tuple_factory  # reset default
-        return d
-    except Exception as e:
-        session.row_factory = named_tuple_factory
-        print("Failed to query exchange rates. Cause: \n%s" % str(e))
-        raise SystemExit
-
-
-def query_last_block_height(currency):
-    set_keyspace(session, currency, space="raw")
-    block_max = 0
-    block_inc = 100000
-    while True:
-        rs = session.execute(block_height_query[currency], [block_max])
-        if not rs:
-            if block_max == 0:
-                return 0
-            if block_inc == 1:
-                return block_max - 1
-            else:
-                block_max -= block_inc
-                block_inc //= 10
+    # a full scan, as a LIMIT would cut off rates in token order, not by
+    # height; rows above h_max are dropped by the rate store
+    print("Loading exchange rates for %s ..." % currency)
+    statement = exchange_rates_query[currency].bind([])
+    statement.fetch_size = max_page_size
+    results = execute(statement, timeout=180, execution_profile=SCAN)
+    rates = [(row.height, row.eur, row.usd) for row in results]
+    print("Rates loaded.")
+    return rates
+
+
+def query_exchange_rates_range(currency, h_min, h_max):
+    results = execute_concurrent_with_args(
+        session, exchange_rate_for_height_query[currency],
+        [(height,) for height in range(h_min, h_max + 1)])
+    return [(row.height, row.eur, row.usd)
+            for (_, rows) in results for row in rows]
+
+
+def refresh_exchange_rates(log_error):
+    """Extend the rates of all currencies to their last block; a currency
+    that fails is passed to log_error and retried in the next cycle."""
+    for currency in list(all_exchange_rates.keys()):
+        try:
+            h_max = query_last_block_height(currency, last_height[currency])
+            store = all_exchange_rates[currency]
+            if exchange_rates_rebuild_interval:
+                store.rebuild(exchange_rates_rebuild_interval, h_max,
+                              partial(query_all_exchange_rates, currency))
+            if h_max <= store.max_height:
+                last_height[currency] = store.max_height
+                continue
+            store.extend(h_max, partial(query_exchange_rates_range, currency))
+            # publish the new height only after the rates are in place
+            last_height[currency] = store.max_height
+        except Exception as e:
+            log_error("Failed to refresh exchange rates of %s: %s" % (currency, e))
+
+
+def statistics_generation(currency):
+    # a new transformed keyspace comes with new summary statistics
+    return (statistics.get(currency) or {}).get("timestamp")
+
+
+def refresh_cache_generation():
+    for currency in list(cache_generation.keys()):
+        generation = statistics_generation(currency)
+        if generation == cache_generation[currency]:
+            continue
+        cache_generation[currency] = generation
+        for entity_cache in caches.values():
+            entity_cache.clear()
+
+
+def start_refresher(app):
+    interval = app.config.get("REFRESH_INTERVAL", 60)
+    if not interval:
+        return
+
+    # each step runs even if an earlier one failed
+    steps = [("exchange rates", partial(refresh_exchange_rates, app.logger.error)),
+             ("statistics", load_statistics),
+             ("cache generation", refresh_cache_generation),
+             ("search indices", refresh_search_indices),
+             ("label index", refresh_label_index)]
+
+    def refresh_periodically():
+        while True:
+            time.sleep(interval)
+            for (name, step) in steps:
+                try:
+                    step()
+                except Exception as e:
+                    app.logger.error("Failed to refresh %s: %s" % (name, e))
+
+    thread = threading.Thread(target=refresh_periodically, daemon=True)
+    thread.start()
+    app.logger.debug("Started refresher.")
+
+
+def query_height_exists(currency, height):
+    return bool(execute(block_height_query[currency], [height]))
+
+
+def query_last_block_height(currency, h_min=0):
+    """Return the highest height with an exchange rate.
+
+    Heights are contiguous, so the tip is found by probing h_min + 1, 2, 4,
+    ... until a height is missing and then bisecting the last interval.
+    Starting from a known height h_min, this takes O(log(tip - h_min))
+    queries."""
+    if h_min and not query_height_exists(currency, h_min):
+        h_min = 0
+    if not query_height_exists(currency, h_min):
+        return 0
+    lower = h_min
+    step = 1
+    upper = lower + step
+    while query_height_exists(currency, upper):
+        lower = upper
+        step *= 2
+        upper = lower + step
+    # lower exists, upper does not
+    while upper - lower > 1:
+        middle = (lower + upper) // 2
+        if query_height_exists(currency, middle):
+            lower = middle
         else:
-            block_max += block_inc
+            upper = middle
+    return lower
 
 
-def query_exchange_rate_for_height(currency, height):
-    if height <= last_height[currency]:
-        res = gm.ExchangeRate(all_exchange_rates[currency][height])
-    else:
-        res = gm.ExchangeRate(all_exchange_rates[currency][last_height[currency]])
-    return res
+def query_exchange_rates_for_heights(currency, heights):
+    """[eur, usd] rates of each height as an array of shape
+    (len(heights), 2); heights beyond the last block get its rates."""
+    heights = [min(height, last_height[currency]) for height in heights]
+    return all_exchange_rates[currency].rates[heights]
+
+
+def log_cluster_options(app, options):
+    for line in cassandraconfig.describe(options):
+        app.logger.info("Cassandra %s" % line)
+
+
+def data_directory(app, key, name):
+    """Directory configured as key, by default name in default_data_dir,
+    or in the temporary directory if default_data_dir is not writable,
+    e.g. for local runs as a regular user."""
+    directory = app.config.get(key)
+    if directory:
+        return directory
+    if os.access(default_data_dir, os.W_OK):
+        return os.path.join(default_data_dir, name)
+    directory = os.path.join(tempfile.gettempdir(), "graphsense-rest", name)
+    app.logger.warning("%s is not writable, using %s" % (default_data_dir, directory))
+    return directory
+
+
+def prepare(name, query):
+    # all statements are reads, so they may be retried and hedged by
+    # speculative executions
+    statement = session.prepare(query)
+    statement.is_idempotent = True
+    statement_names[id(statement)] = name
+    return statement
 
 
-def connect(app):
+def connect(app, connection_class=None):
     global address_cluster_query, address_incoming_relations_query, \
            address_outgoing_relations_query, address_query, \
            address_search_query, address_tags_query, \
@@ -461,63 +1136,102 @@ def connect(app):
            cluster_query, cluster_tags_query, keyspace_mapping, \
            exchange_rate_for_height_query, exchange_rates_query, \
            last_height, session, statistics_query, transaction_search_query, \
-           tx_query, txs_query, label_search_query, label_query, tags_query
-
-    cluster = cassandra.cluster.Cluster(app.config["CASSANDRA_NODES"])
+           tx_query, txs_query, label_search_query, label_query, tags_query, \
+           caches, search_budget, search_index_dir, all_labels_query, \
+           label_index_refresh_interval, statistics_ttl, max_page_size, \
+           page_bytes, exchange_rates_rebuild_interval, search_index_max_lag
+
+    options = cassandraconfig.cluster_options(app.config.get("CASSANDRA", {}))
+    log_cluster_options(app, options)
+    if connection_class is not None:
+        options["connection_class"] = connection_class
+    cluster = cassandra.cluster.Cluster(app.config["CASSANDRA_NODES"], **options)
     app.logger.debug("Created new Cassandra cluster.")
 
-    # set the first keyspace in mapping to the default in order to be able to
-    # create the prepared statements; alternative strategy is to not use
-    # prepared statements and specify the keyspace in the query string
+    # all statements are prepared with keyspace-qualified table names, so
+    # the shared session never has to switch keyspaces at request time
     keyspace_mapping = app.config["MAPPING"]
-    if "tagpacks" in keyspace_mapping.keys() and keyspace_mapping["tagpacks"] == "tagpacks":
-        keyspace_name = "tagpacks"  # it must be "tagpacks"
-    else:
+    if "tagpacks" not in keyspace_mapping.keys() or keyspace_mapping["tagpacks"] != "tagpacks":
         abort(404, "Tagpacks keyspace missing")
 
-    session = cluster.connect(keyspace_mapping[keyspace_name])
-    session.default_fetch_size = 10
+    session = cluster.connect()
+    # one-off statements are unpaged; listings are paged per request, see
+    # execute_page
+    session.default_fetch_size = None
     app.logger.debug("Created new Cassandra session.")
-    label_search_query = session.prepare("SELECT label,label_norm FROM tag_by_label WHERE label_norm_prefix = ? GROUP BY label_norm_prefix, label_norm")
-    label_query = session.prepare("SELECT label_norm, label_norm_prefix, label, COUNT(address) as address_count FROM tag_by_label WHERE label_norm_prefix = ? and label_norm = ? GROUP BY label_norm_prefix, label_norm")
-    tags_query = session.prepare("SELECT * FROM tag_by_label WHERE label_norm_prefix = ? and label_norm = ?")
+    tagpacks = keyspace_mapping["tagpacks"]
+    rates_dir = data_directory(app, "EXCHANGE_RATES_DIR", "rates")
+    search_index_dir = data_directory(app, "SEARCH_INDEX_DIR", "search")
+    search_index_max_lag = app.config.get("SEARCH_INDEX_MAX_LAG", 100)
+    label_search_query = prepare("label_search_query", "SELECT label,label_norm FROM %s.tag_by_label WHERE label_norm_prefix = ? GROUP BY label_norm_prefix, label_norm" % tagpacks)
+    label_query = prepare("label_query", "SELECT label_norm, label_norm_prefix, label, COUNT(address) as address_count FROM %s.tag_by_label WHERE label_norm_prefix = ? and label_norm = ? GROUP BY label_norm_prefix, label_norm" % tagpacks)
+    all_labels_query = prepare("all_labels_query", "SELECT label_norm, label, COUNT(address) as address_count FROM %s.tag_by_label GROUP BY label_norm_prefix, label_norm" % tagpacks)
+    tags_query = prepare("tags_query", "SELECT * FROM %s.tag_by_label WHERE label_norm_prefix = ? and label_norm = ?" % tagpacks)
     for keyspace_name in keyspace_mapping.keys():
         if keyspace_name == "tagpacks":
             continue
-        set_keyspace(session, keyspace_name)
-        address_query[keyspace_name] = session.prepare("SELECT * FROM address WHERE address = ? AND address_prefix = ?")
-        address_search_query[keyspace_name] = session.prepare("SELECT address FROM address WHERE address_prefix = ?")
-        address_transactions_query[keyspace_name] = session.prepare("SELECT * FROM address_transactions WHERE address = ? AND address_prefix = ? LIMIT ?")
-        address_transactions_without_limit_query[keyspace_name] = session.prepare("SELECT * FROM address_transactions WHERE address = ? AND address_prefix = ?")
-        address_tags_query[keyspace_name] = session.prepare("SELECT * FROM address_tags WHERE address = ?")
-        address_cluster_query[keyspace_name] = session.prepare("SELECT cluster FROM address_cluster WHERE address = ? AND address_prefix = ?")
-        address_incoming_relations_query[keyspace_name] = session.prepare("SELECT * FROM address_incoming_relations WHERE dst_address_prefix = ? AND dst_address = ? LIMIT ?")
-        address_incoming_relations_without_limit_query[keyspace_name] = session.prepare("SELECT * FROM address_incoming_relations WHERE dst_address_prefix = ? AND dst_address = ?")
-        address_outgoing_relations_query[keyspace_name] = session.prepare("SELECT * FROM address_outgoing_relations WHERE src_address_prefix = ? AND src_address = ? LIMIT ?")
-        address_outgoing_relations_without_limit_query[keyspace_name] = session.prepare("SELECT * FROM address_outgoing_relations WHERE src_address_prefix = ? AND src_address = ?")
-        cluster_incoming_relations_query[keyspace_name] = session.prepare("SELECT * FROM cluster_incoming_relations WHERE dst_cluster = ? LIMIT ?")
-        cluster_incoming_relations_without_limit_query[keyspace_name] = session.prepare("SELECT * FROM cluster_incoming_relations WHERE dst_cluster = ?")
-        cluster_outgoing_relations_query[keyspace_name] = session.prepare("SELECT * FROM cluster_outgoing_relations WHERE src_cluster = ? LIMIT ?")
-        cluster_outgoing_relations_without_limit_query[keyspace_name] = session.prepare("SELECT * FROM cluster_outgoing_relations WHERE src_cluster = ?")
-        cluster_tags_query[keyspace_name] = session.prepare("SELECT * FROM cluster_tags WHERE cluster = ?")
-        cluster_query[keyspace_name] = session.prepare("SELECT * FROM cluster WHERE cluster = ?")
-        cluster_addresses_query[keyspace_name] = session.prepare("SELECT * FROM cluster_addresses WHERE cluster = ? LIMIT ?")
-        cluster_addresses_without_limit_query[keyspace_name] = session.prepare("SELECT * FROM cluster_addresses WHERE cluster = ?")
-        statistics_query[keyspace_name] = session.prepare("SELECT * FROM summary_statistics LIMIT 1")
-
-        set_keyspace(session, keyspace_name, space="raw")
-        tx_query[keyspace_name] = session.prepare("SELECT * FROM transaction WHERE tx_prefix = ? AND tx_hash = ?")
-        txs_query[keyspace_name] = session.prepare("SELECT * FROM transaction LIMIT ?")
-        transaction_search_query[keyspace_name] = session.prepare("SELECT tx_hash from transaction where tx_prefix = ?")
-        block_transactions_query[keyspace_name] = session.prepare("SELECT * FROM block_transactions WHERE height = ?")
-        block_query[keyspace_name] = session.prepare("SELECT * FROM block WHERE height = ?")
-        blocks_query[keyspace_name] = session.prepare("SELECT * FROM block LIMIT ?")
-        exchange_rates_query[keyspace_name] = session.prepare("SELECT * FROM exchange_rates LIMIT ?")
-        exchange_rate_for_height_query[keyspace_name] = session.prepare("SELECT * FROM exchange_rates WHERE height = ?")
-        block_height_query[keyspace_name] = session.prepare("SELECT height FROM exchange_rates WHERE height = ?")
-
-        last_height[keyspace_name] = query_last_block_height(keyspace_name)
-        all_exchange_rates[keyspace_name] = query_all_exchange_rates(keyspace_name,
-                                                                last_height[keyspace_name])
+        (raw, transformed) = keyspace_mapping[keyspace_name]
+        address_query[keyspace_name] = prepare("address_query", "SELECT * FROM %s.address WHERE address = ? AND address_prefix = ?" % transformed)
+        address_search_query[keyspace_name] = prepare("address_search_query", "SELECT address FROM %s.address WHERE address_prefix = ?" % transformed)
+        address_transactions_query[keyspace_name] = prepare("address_transactions_query", "SELECT * FROM %s.address_transactions WHERE address = ? AND address_prefix = ? LIMIT ?" % transformed)
+        address_transactions_without_limit_query[keyspace_name] = prepare("address_transactions_without_limit_query", "SELECT * FROM %s.address_transactions WHERE address = ? AND address_prefix = ?" % transformed)
+        address_tags_query[keyspace_name] = prepare("address_tags_query", "SELECT * FROM %s.address_tags WHERE address = ?" % transformed)
+        address_cluster_query[keyspace_name] = prepare("address_cluster_query", "SELECT cluster FROM %s.address_cluster WHERE address = ? AND address_prefix = ?" % transformed)
+        address_incoming_relations_query[keyspace_name] = prepare("address_incoming_relations_query", "SELECT * FROM %s.address_incoming_relations WHERE dst_address_prefix = ? AND dst_address = ? LIMIT ?" % transformed)
+        address_incoming_relations_without_limit_query[keyspace_name] = prepare("address_incoming_relations_without_limit_query", "SELECT * FROM %s.address_incoming_relations WHERE dst_address_prefix = ? AND dst_address = ?" % transformed)
+        address_outgoing_relations_query[keyspace_name] = prepare("address_outgoing_relations_query", "SELECT * FROM %s.address_outgoing_relations WHERE src_address_prefix = ? AND src_address = ? LIMIT ?" % transformed)
+        address_outgoing_relations_without_limit_query[keyspace_name] = prepare("address_outgoing_relations_without_limit_query", "SELECT * FROM %s.address_outgoing_relations WHERE src_address_prefix = ? AND src_address = ?" % transformed)
+        cluster_incoming_relations_query[keyspace_name] = prepare("cluster_incoming_relations_query", "SELECT * FROM %s.cluster_incoming_relations WHERE dst_cluster = ? LIMIT ?" % transformed)
+        cluster_incoming_relations_without_limit_query[keyspace_name] = prepare("cluster_incoming_relations_without_limit_query", "SELECT * FROM %s.cluster_incoming_relations WHERE dst_cluster = ?" % transformed)
+        cluster_outgoing_relations_query[keyspace_name] = prepare("cluster_outgoing_relations_query", "SELECT * FROM %s.cluster_outgoing_relations WHERE src_cluster = ? LIMIT ?" % transformed)
+        cluster_outgoing_relations_without_limit_query[keyspace_name] = prepare("cluster_outgoing_relations_without_limit_query", "SELECT * FROM %s.cluster_outgoing_relations WHERE src_cluster = ?" % transformed)
+        cluster_tags_query[keyspace_name] = prepare("cluster_tags_query", "SELECT * FROM %s.cluster_tags WHERE cluster = ?" % transformed)
+        cluster_query[keyspace_name] = prepare("cluster_query", "SELECT * FROM %s.cluster WHERE cluster = ?" % transformed)
+        cluster_addresses_query[keyspace_name] = prepare("cluster_addresses_query", "SELECT * FROM %s.cluster_addresses WHERE cluster = ? LIMIT ?" % transformed)
+        cluster_addresses_without_limit_query[keyspace_name] = prepare("cluster_addresses_without_limit_query", "SELECT * FROM %s.cluster_addresses WHERE cluster = ?" % transformed)
+        statistics_query[keyspace_name] = prepare("statistics_query", "SELECT * FROM %s.summary_statistics LIMIT 1" % transformed)
+
+        tx_query[keyspace_name] = prepare("tx_query", "SELECT * FROM %s.transaction WHERE tx_prefix = ? AND tx_hash = ?" % raw)
+        txs_query[keyspace_name] = prepare("txs_query", "SELECT * FROM %s.transaction LIMIT ?" % raw)
+        transaction_search_query[keyspace_name] = prepare("transaction_search_query", "SELECT tx_hash from %s.transaction where tx_prefix = ?" % raw)
+        block_transactions_query[keyspace_name] = prepare("block_transactions_query", "SELECT * FROM %s.block_transactions WHERE height = ?" % raw)
+        block_query[keyspace_name] = prepare("block_query", "SELECT * FROM %s.block WHERE height = ?" % raw)
+        blocks_query[keyspace_name] = prepare("blocks_query", "SELECT * FROM %s.block LIMIT ?" % raw)
+        exchange_rates_query[keyspace_name] = prepare("exchange_rates_query", "SELECT * FROM %s.exchange_rates" % raw)
+        exchange_rate_for_height_query[keyspace_name] = prepare("exchange_rate_for_height_query", "SELECT * FROM %s.exchange_rates WHERE height = ?" % raw)
+        block_height_query[keyspace_name] = prepare("block_height_query", "SELECT height FROM %s.exchange_rates WHERE height = ?" % raw)
+
+        last_height[keyspace_name] = query_last_block_height(
+            keyspace_name, ratestore.stored_max_height(rates_dir, raw))
+        try:
+            all_exchange_rates[keyspace_name] = ratestore.open_store(
+                rates_dir, raw, last_height[keyspace_name],
+                partial(query_all_exchange_rates, keyspace_name),
+                partial(query_exchange_rates_range, keyspace_name))
+        except Exception as e:
+            print("Failed to query exchange rates. Cause: \n%s" % str(e))
+            raise SystemExit
+        open_search_indices(keyspace_name)
 
     app.logger.debug("Created prepared statements")
+
+    statistics_ttl = app.config.get("STATISTICS_TTL", 300)
+    exchange_rates_rebuild_interval = app.config.get("EXCHANGE_RATES_REBUILD_INTERVAL", 86400)
+    max_page_size = app.config.get("MAX_PAGE_SIZE", 10000)
+    page_bytes = app.config.get("PAGE_BYTES", 1 << 20)
+    load_statistics()
+    for currency in statistics.keys():
+        cache_generation[currency] = statistics_generation(currency)
+
+    label_index_refresh_interval = app.config.get("LABEL_INDEX_REFRESH_INTERVAL", 3600)
+    try:
+        load_label_index()
+        app.logger.debug("Loaded %d labels." % len(label_index))
+    except Exception as e:
+        app.logger.error("Failed to load label index: %s" % e)
+
+    search_budget = app.config.get("SEARCH_BUDGET", {})
+    caches = cache.create_caches(app.config.get("CACHE", {}), cached_entities)
+    app.logger.debug("Created caches for %s" % ", ".join(caches.keys()))
+
+    start_refresher(app)
@@ -1,29 +1,71 @@
 
 
+import numpy as np
+
+
 def byte_to_hex(bytebuffer):
-    return "".join(("%02x" % a) for a in bytebuffer)
+    return bytebuffer.hex()
+
+
+class Model(object):
+    """Base class of the models. Attributes are kept in __slots__ instead
+    of a dict per object, nested models are kept as objects and only
+    converted by to_dict, or read directly by marshal."""
+    __slots__ = ()
+
+    def to_dict(self):
+        d = {}
+        for name in self.__slots__:
+            try:
+                d[name] = plain(getattr(self, name))
+            except AttributeError:
+                pass
+        return d
+
+
+def plain(value):
+    if isinstance(value, Model):
+        return value.to_dict()
+    if type(value) is list:
+        return [plain(item) for item in value]
+    return value
 
 
 # CASSSANDRA TYPES
-class TxInputOutput(object):
+class TxInputOutput(Model):
+    __slots__ = ("address", "value")
+
     def __init__(self, address, value):
         self.address = address[0]
         self.value = value
 
 
-class Value(object):
+class Value(Model):
+    __slots__ = ("satoshi", "eur", "usd")
+
     def __init__(self, satoshi, eur, usd):
         self.satoshi = satoshi
         self.eur = round(eur, 2)
         self.usd = round(usd, 2)
 
+    @classmethod
+    def rounded(cls, satoshi, eur, usd):
+        """Value of fiat amounts which are already rounded."""
+        value = cls.__new__(cls)
+        value.satoshi = satoshi
+        value.eur = eur
+        value.usd = usd
+        return value
+
     def __sub__(self, other):
         return Value(self.satoshi-other.satoshi,
                      round(self.eur-other.eur, 2),
                      round(self.usd-other.usd, 2))
 
 
-class TxIdTime(object):
+class TxIdTime(Model):
+    __slots__ = ("height", "tx_hash", "timestamp")
+
     def __init__(self, height, tx_hash, timestamp):
         self.height = height
         self.tx_hash = tx_hash
@@ -37,20 +79,27 @@ class TxIdTime(object):
         }
 
 
-class AddressSummary(object):
+class AddressSummary(Model):
+    __slots__ = ("totalReceived", "totalSpent")
+
     def __init__(self, total_received, total_spent):
         self.totalReceived = total_received
         self.totalSpent = total_spent
 
 
 # CASSSANDRA TABLES
-class ExchangeRate(object):
+class ExchangeRate(Model):
+    __slots__ = ("eur", "usd")
+
     def __init__(self, d):
         self.eur = d["eur"]
         self.usd = d["usd"]
 
 
-class Statistics(object):
+class Statistics(Model):
+    __slots__ = ("no_blocks", "no_address_relations", "no_addresses",
+                 "no_clusters", "no_transactions", "no_labels", "timestamp")
+
     def __init__(self, row):
         self.no_blocks = row.no_blocks
         self.no_address_relations = row.no_address_relations
@@ -61,7 +110,10 @@ class Statistics(object):
         self.timestamp = row.timestamp
 
 
-class Tag(object):
+class Tag(Model):
+    __slots__ = ("address", "label", "category", "tagpack_uri", "source",
+                 "lastmod")
+
     def __init__(self, row):
         self.address = row.address
         self.label = row.label
@@ -71,54 +123,82 @@ class Tag(object):
         self.lastmod = row.lastmod
 
 
-class Label(object):
+class Label(Model):
+    __slots__ = ("label_norm_prefix", "label_norm", "label", "address_count")
+
     def __init__(self, row):
         self.label_norm_prefix = row.label_norm_prefix
         self.label_norm = row.label_norm
         self.label = row.label
         self.address_count = row.address_count
 
-class Transaction(object):
-    def __init__(self, row, rates):
+class Transaction(Model):
+    __slots__ = ("txHash", "coinbase", "height", "inputs", "outputs",
+                 "timestamp", "totalInput", "totalOutput")
+
+    def __init__(self, row, values):
+        """values are the Values of transaction_amounts(row)."""
         self.txHash = byte_to_hex(row.tx_hash)
         self.coinbase = row.coinbase
         self.height = row.height
-        if row.inputs:
-            self.inputs = [TxInputOutput(input.address,
-                                         Value(input.value,
-                                               round(input.value*rates.eur*1e-8, 2),
-                                               round(input.value*rates.usd*1e-8, 2)).__dict__).__dict__
-                           for input in row.inputs]
-        else:
-            self.inputs = []
-        self.outputs = [TxInputOutput(output.address,
-                                      Value(output.value,
-                                            round(output.value*rates.eur*1e-8, 2),
-                                            round(output.value*rates.usd*1e-8, 2)).__dict__).__dict__
-                        for output in row.outputs if output.address]
+        inputs = row.inputs or []
+        self.inputs = [TxInputOutput(input.address, value)
+                       for (input, value) in zip(inputs, values)]
+        self.outputs = [TxInputOutput(output.address, value)
+                        for (output, value) in zip([output for output in row.outputs if output.address],
+                                                   values[len(inputs):])]
         self.timestamp = row.timestamp
-        self.totalInput = Value(row.total_input,
-                                round(row.total_input*rates.eur*1e-8, 2),
-                                round(row.total_input*rates.usd*1e-8, 2)).__dict__
-        self.totalOutput = Value(row.total_output,
-                                 round(row.total_output*rates.eur*1e-8, 2),
-                                 round(row.total_output*rates.usd*1e-8, 2)).__dict__
+        self.totalInput = values[-2]
+        self.totalOutput = values[-1]
 
 
-class BlockTransaction(object):
-    def __init__(self, row, rates):
+def transaction_amounts(row):
+    return ([input.value for input in row.inputs or []] +
+            [output.value for output in row.outputs if output.address] +
+            [row.total_input, row.total_output])
+
+
+def transactions(rows, rates):
+    """Transactions of rows, each valued at the [eur, usd] rates in the
+    same row of rates."""
+    amounts = [transaction_amounts(row) for row in rows]
+    values = exchanged_values(
+        [amount for row_amounts in amounts for amount in row_amounts],
+        np.repeat(rates, [len(row_amounts) for row_amounts in amounts], axis=0))
+    txs = []
+    start = 0
+    for (row, row_amounts) in zip(rows, amounts):
+        end = start + len(row_amounts)
+        txs.append(Transaction(row, values[start:end]))
+        start = end
+    return txs
+
+
+class BlockTransaction(Model):
+    __slots__ = ("txHash", "noInputs", "noOutputs", "totalInput",
+                 "totalOutput")
+
+    def __init__(self, row, total_input, total_output):
         self.txHash = byte_to_hex(row.tx_hash)
         self.noInputs = row.no_inputs
         self.noOutputs = row.no_outputs
-        self.totalInput = Value(row.total_input,
-                                round(row.total_input*rates.eur*1e-8, 2),
-                                round(row.total_input*rates.usd*1e-8, 2)).__dict__
-        self.totalOutput = Value(row.total_output,
-                                 round(row.total_output*rates.eur*1e-8, 2),
-                                 round(row.total_output*rates.usd*1e-8, 2)).__dict__
+        self.totalInput = total_input
+        self.totalOutput = total_output
+
+
+def block_transactions(rows, rates):
+    """BlockTransactions of rows, all valued at the [eur, usd] rates of
+    their block."""
+    values = exchanged_values([row.total_input for row in rows] +
+                              [row.total_output for row in rows], rates)
+    return [BlockTransaction(row, total_input, total_output)
+            for (row, total_input, total_output)
+            in zip(rows, values[:len(rows)], values[len(rows):])]
+
 
+class Block(Model):
+    __slots__ = ("height", "blockHash", "noTransactions", "timestamp")
 
-class Block(object):
     def __init__(self, row):
         self.height = row.height
         self.blockHash = byte_to_hex(row.block_hash)
@@ -126,36 +206,42 @@ class Block(object):
         self.timestamp = row.timestamp
 
 
-class BlockWithTransactions(object):
+class BlockWithTransactions(Model):
+    __slots__ = ("height", "txs")
+
     def __init__(self, row, rates):
         self.height = row.height
-        self.txs = [BlockTransaction(tx, rates).__dict__ for tx in row.txs]
+        self.txs = block_transactions(row.txs, rates)
+
 
+class Address(Model):
+    __slots__ = ("address_prefix", "address", "firstTx", "lastTx",
+                 "noIncomingTxs", "noOutgoingTxs", "totalReceived",
+                 "totalSpent", "balance", "inDegree", "outDegree", "tags")
 
-class Address(object):
     def __init__(self, row, exchange_rate):
         self.address_prefix = row.address_prefix
         self.address = row.address
         self.firstTx = TxIdTime(row.first_tx.height,
                                 byte_to_hex(row.first_tx.tx_hash),
-                                row.first_tx.timestamp).__dict__
+                                row.first_tx.timestamp)
         self.lastTx = TxIdTime(row.last_tx.height,
                                byte_to_hex(row.last_tx.tx_hash),
-                               row.last_tx.timestamp).__dict__
+                               row.last_tx.timestamp)
         self.noIncomingTxs = row.no_incoming_txs
         self.noOutgoingTxs = row.no_outgoing_txs
         received = Value(row.total_received.satoshi,
                          round(row.total_received.eur, 2),
                          round(row.total_received.usd, 2))
-        self.totalReceived = received.__dict__
+        self.totalReceived = received
         spent = Value(row.total_spent.satoshi,
                       round(row.total_spent.eur, 2),
                       round(row.total_spent.usd, 2))
-        self.totalSpent = spent.__dict__
+        self.totalSpent = spent
         balance = compute_balance(row.total_received.satoshi,
                                   row.total_spent.satoshi,
                                   exchange_rate)
-        self.balance = balance.__dict__
+        self.balance = balance
         self.inDegree = row.in_degree
         self.outDegree = row.out_degree
 
@@ -175,54 +261,79 @@ def compute_exchanged_value(value, exchange_rate):
                  round(value*exchange_rate.usd*1e-8, 2))
 
 
-class AddressTransactions(object):
-    def __init__(self, row, rates):
+def exchanged_values(satoshis, rates):
+    """Values of a list of satoshi amounts, computed in one pass at the
+    [eur, usd] rates in the same row of the array rates, or all at a
+    single [eur, usd] row."""
+    fiat = np.round(np.array(satoshis, dtype=np.float64).reshape(-1, 1) * rates * 1e-8, 2)
+    return [Value.rounded(satoshi, eur, usd)
+            for (satoshi, (eur, usd)) in zip(satoshis, fiat.tolist())]
+
+
+class AddressTransactions(Model):
+    __slots__ = ("address", "address_prefix", "txHash", "value", "height",
+                 "timestamp", "txIndex")
+
+    def __init__(self, row, value):
         self.address = row.address
         self.address_prefix = row.address_prefix
         self.txHash = byte_to_hex(row.tx_hash)
-        self.value = Value(row.value,
-                           round(row.value*rates.eur*1e-8, 2),
-                           round(row.value*rates.usd*1e-8, 2)).__dict__
+        self.value = value
         self.height = row.height
         self.timestamp = row.timestamp
         self.txIndex = row.tx_index
 
 
-class Cluster(object):
+def address_transactions(rows, rates):
+    """AddressTransactions of rows, each valued at the [eur, usd] rates in
+    the same row of rates."""
+    values = exchanged_values([row.value for row in rows], rates)
+    return [AddressTransactions(row, value) for (row, value) in zip(rows, values)]
+
+
+class Cluster(Model):
+    __slots__ = ("cluster", "firstTx", "lastTx", "noAddresses",
+                 "noIncomingTxs", "noOutgoingTxs", "totalReceived",
+                 "totalSpent", "balance", "inDegree", "outDegree", "tags")
+
     def __init__(self, row, exchange_rate):
         self.cluster = int(row.cluster)
         self.firstTx = TxIdTime(row.first_tx.height,
                                 byte_to_hex(row.first_tx.tx_hash),
-                                row.first_tx.timestamp).__dict__
+                                row.first_tx.timestamp)
         self.lastTx = TxIdTime(row.last_tx.height,
                                byte_to_hex(row.last_tx.tx_hash),
-                               row.last_tx.timestamp).__dict__
+                               row.last_tx.timestamp)
         self.noAddresses = row.no_addresses
         self.noIncomingTxs = row.no_incoming_txs
         self.noOutgoingTxs = row.no_outgoing_txs
         received = Value(row.total_received.satoshi,
                          round(row.total_received.eur, 2),
                          round(row.total_received.usd, 2))
-        self.totalReceived = received.__dict__
+        self.totalReceived = received
         spent = Value(row.total_spent.satoshi,
                       round(row.total_spent.eur, 2),
                       round(row.total_spent.usd, 2))
-        self.totalSpent = spent.__dict__
+        self.totalSpent = spent
         balance = compute_balance(row.total_received.satoshi,
                                   row.total_spent.satoshi,
                                   exchange_rate)
-        self.balance = balance.__dict__
+        self.balance = balance
         self.inDegree = row.in_degree
         self.outDegree = row.out_degree
 
 
-class AddressIncomingRelations(object):
+class AddressIncomingRelations(Model):
+    __slots__ = ("dstAddressPrefix", "dstAddress", "estimatedValue",
+                 "srcAddress", "noTransactions", "srcBalance",
+                 "srcTotalReceived", "srcProperties")
+
     def __init__(self, row, exchange_rate):
         self.dstAddressPrefix = row.dst_address_prefix
         self.dstAddress = row.dst_address
         self.estimatedValue = Value(row.estimated_value.satoshi,
                                     round(row.estimated_value.eur, 2),
-                                    round(row.estimated_value.usd, 2)).__dict__
+                                    round(row.estimated_value.usd, 2))
         self.srcAddress = row.src_address
         self.noTransactions = row.no_transactions
         self.srcBalance = compute_balance(row.src_properties.total_received,
@@ -249,27 +360,31 @@ class AddressIncomingRelations(object):
         edge = {"source": self.srcAddress,
                 "target": self.dstAddress,
                 "transactions": self.noTransactions,
-                "estimatedValue": self.estimatedValue}
+                "estimatedValue": self.estimatedValue.to_dict()}
         return edge
 
     def toJson(self):
         return {
             "id": self.id(),
             "nodeType": "address",
-            "received": self.srcTotalReceived.__dict__,
-            "balance": self.srcBalance.__dict__,
+            "received": self.srcTotalReceived.to_dict(),
+            "balance": self.srcBalance.to_dict(),
             "noTransactions": self.noTransactions,
-            "estimatedValue": self.estimatedValue
+            "estimatedValue": self.estimatedValue.to_dict()
         }
 
 
-class AddressOutgoingRelations(object):
+class AddressOutgoingRelations(Model):
+    __slots__ = ("srcAddressPrefix", "srcAddress", "estimatedValue",
+                 "dstAddress", "noTransactions", "dstBalance",
+                 "dstTotalReceived", "dstProperties")
+
     def __init__(self, row, exchange_rate):
         self.srcAddressPrefix = row.src_address_prefix
         self.srcAddress = row.src_address
         self.estimatedValue = Value(row.estimated_value.satoshi,
                                     round(row.estimated_value.eur, 2),
-                                    round(row.estimated_value.usd, 2)).__dict__
+                                    round(row.estimated_value.usd, 2))
         self.dstAddress = row.dst_address
         self.noTransactions = row.no_transactions
         self.dstBalance = compute_balance(row.dst_properties.total_received,
@@ -296,28 +411,33 @@ class AddressOutgoingRelations(object):
         edge = {"source": self.srcAddress,
                 "target": self.dstAddress,
                 "transactions": self.noTransactions,
-                "estimatedValue": self.estimatedValue}
+                "estimatedValue": self.estimatedValue.to_dict()}
         return edge
 
     def toJson(self):
         return {
             "id": self.id(),
             "nodeType": "address",
-            "received": self.dstTotalReceived.__dict__,
-            "balance": self.dstBalance.__dict__,
+            "received": self.dstTotalReceived.to_dict(),
+            "balance": self.dstBalance.to_dict(),
             "noTransactions": self.noTransactions,
-            "estimatedValue": self.estimatedValue
+            "estimatedValue": self.estimatedValue.to_dict()
         }
 
 
-class ClusterSummary(object):
+class ClusterSummary(Model):
+    __slots__ = ("noAddresses", "totalReceived", "totalSpent")
+
     def __init__(self, no_addresses, total_received, total_spent):
         self.noAddresses = no_addresses
         self.totalReceived = total_received
         self.totalSpent = total_spent
 
 
-class ClusterIncomingRelations(object):
+class ClusterIncomingRelations(Model):
+    __slots__ = ("dstCluster", "srcCluster", "srcProperties", "value",
+                 "noTransactions", "srcBalance", "srcTotalReceived")
+
     def __init__(self, row, exchange_rate):
         self.dstCluster = str(row.dst_cluster)
         self.srcCluster = str(row.src_cluster)
@@ -326,7 +446,7 @@ class ClusterIncomingRelations(object):
                                             row.src_properties.total_spent)
         self.value = Value(row.value.satoshi,
                            round(row.value.eur, 2),
-                           round(row.value.usd, 2)).__dict__
+                           round(row.value.usd, 2))
         self.noTransactions = row.no_transactions
         self.srcBalance = compute_balance(row.src_properties.total_received,
                                           row.src_properties.total_spent,
@@ -350,21 +470,24 @@ class ClusterIncomingRelations(object):
         edge = {"source": self.srcCluster,
                 "target": self.dstCluster,
                 "transactions": self.noTransactions,
-                "estimatedValue": self.value}
+                "estimatedValue": self.value.to_dict()}
         return edge
 
     def toJson(self):
         return {
             "id": self.id(),
             "nodeType": "cluster" if self.id().isdigit() else "address",
-            "received": self.srcTotalReceived.__dict__,
-            "balance": self.srcBalance.__dict__,
+            "received": self.srcTotalReceived.to_dict(),
+            "balance": self.srcBalance.to_dict(),
             "noTransactions": self.noTransactions,
-            "estimatedValue": self.value
+            "estimatedValue": self.value.to_dict()
         }
 
 
-class ClusterOutgoingRelations(object):
+class ClusterOutgoingRelations(Model):
+    __slots__ = ("srcCluster", "dstCluster", "dstProperties", "value",
+                 "noTransactions", "dstBalance", "dstTotalReceived")
+
     def __init__(self, row, exchange_rate):
         self.srcCluster = str(row.src_cluster)
         self.dstCluster = str(row.dst_cluster)
@@ -373,7 +496,7 @@ class ClusterOutgoingRelations(object):
                                             row.dst_properties.total_spent)
         self.value = Value(row.value.satoshi,
                            round(row.value.eur, 2),
-                           round(row.value.usd, 2)).__dict__
+                           round(row.value.usd, 2))
         self.noTransactions = row.no_transactions
         self.dstBalance = compute_balance(row.dst_properties.total_received,
                                           row.dst_properties.total_spent,
@@ -397,17 +520,17 @@ class ClusterOutgoingRelations(object):
         edge = {"source": self.srcCluster,
                 "target": self.dstCluster,
                 "transactions": self.noTransactions,
-                "estimatedValue": self.value}
+                "estimatedValue": self.value.to_dict()}
         return edge
 
     def toJson(self):
         return {
             "id": self.id(),
             "nodeType": "cluster" if self.id().isdigit() else "address",
-            "received": self.dstTotalReceived.__dict__,
-            "balance": self.dstBalance.__dict__,
+            "received": self.dstTotalReceived.to_dict(),
+            "balance": self.dstBalance.to_dict(),
             "noTransactions": self.noTransactions,
-            "estimatedValue": self.value
+            "estimatedValue": self.value.to_dict()
         }
 
 
@@ -421,9 +544,9 @@ class AddressEgoNet(object):
         self.outgoingRelations = outgoing_relations
         self.focusNode = [{"id": self.focusAddress.address,
                            "nodeType": "address",
-                           "received": self.focusAddress.totalReceived["satoshi"],
-                           "balance": (self.focusAddress.totalReceived["satoshi"] -
-                                       self.focusAddress.totalSpent["satoshi"]),
+                           "received": self.focusAddress.totalReceived.satoshi,
+                           "balance": (self.focusAddress.totalReceived.satoshi -
+                                       self.focusAddress.totalSpent.satoshi),
                            }]
 
     # receives a List[EgonetRelation]
@@ -484,9 +607,9 @@ class ClusterEgoNet(object):
         self.focusNode = [{
             "id": self.focusCluster.cluster,
             "nodeType": "cluster",
-            "received": self.focusCluster.totalReceived["satoshi"],
-            "balance": (self.focusCluster.totalReceived["satoshi"] -
-                        self.focusCluster.totalSpent["satoshi"]),
+            "received": self.focusCluster.totalReceived.satoshi,
+            "balance": (self.focusCluster.totalReceived.satoshi -
+                        self.focusCluster.totalSpent.satoshi),
         }]
 
     def dedupNodes(self, clusterRelations):
@@ -532,7 +655,11 @@ class ClusterEgoNet(object):
         return ret
 
 
-class ClusterAddresses(object):
+class ClusterAddresses(Model):
+    __slots__ = ("cluster", "address", "noIncomingTxs", "noOutgoingTxs",
+                 "firstTx", "lastTx", "totalReceived", "totalSpent", "balance",
+                 "inDegree", "outDegree")
+
     def __init__(self, row, exchange_rate):
         self.cluster = str(row.cluster)
         self.address = row.address
@@ -540,21 +667,21 @@ class ClusterAddresses(object):
         self.noOutgoingTxs = row.no_outgoing_txs
         self.firstTx = TxIdTime(row.first_tx.height,
                                 byte_to_hex(row.first_tx.tx_hash),
-                                row.first_tx.timestamp).__dict__
+                                row.first_tx.timestamp)
         self.lastTx = TxIdTime(row.last_tx.height,
                                byte_to_hex(row.last_tx.tx_hash),
-                               row.last_tx.timestamp).__dict__
+                               row.last_tx.timestamp)
         totalReceived = Value(row.total_received.satoshi,
                               round(row.total_received.eur, 2),
                               round(row.total_received.usd, 2))
-        self.totalReceived = totalReceived.__dict__
+        self.totalReceived = totalReceived
         totalSpent = Value(row.total_spent.satoshi,
                            round(row.total_spent.eur, 2),
                            round(row.total_spent.usd, 2))
-        self.totalSpent = totalSpent.__dict__
+        self.totalSpent = totalSpent
         balance = compute_balance(row.total_received.satoshi,
                                   row.total_spent.satoshi,
                                   exchange_rate)
-        self.balance = balance.__dict__
+        self.balance = balance
         self.inDegree = row.in_degree
         self.outDegree = row.out_degree
@@ -2,17 +2,21 @@ import json
 import re
 from functools import wraps
 from flask import Flask, request, abort, Response
-from flask_restplus import Api, Resource, fields
+from flask_restplus import Api, Resource, fields, marshal
 from flask_cors import CORS
 from flask_jwt_extended import (JWTManager, create_access_token, create_refresh_token, jwt_required, jwt_refresh_token_required, get_jwt_identity, get_raw_jwt)
 from flask_jwt_extended import exceptions as jwt_extended_exceptions
 from flask_sqlalchemy import SQLAlchemy
 import graphsensedao as gd
-import graphsensemodel as gm
+import fastjson
+import columnar
+import metrics
 
 
 label_prefix_len = 3
 address_prefix_len = transaction_prefix_len = 5
+stream_pagesize = 1000
+batch_limit = 1000
 pattern = re.compile(r"[\W_]+", re.UNICODE)  # only alphanumeric chars for label
 
 
@@ -61,15 +65,23 @@ app.config["PROPAGATE_EXCEPTIONS"] = True
 
 app.config.from_envvar("GRAPHSENSE_REST_SETTINGS", silent=True)
 
+# uWSGI leaves the root logger at WARNING, which would hide startup info
+app.logger.setLevel(app.config.get("LOG_LEVEL", "INFO"))
+
 CORS(app, supports_credentials=True)
 jwt = JWTManager(app)
 db = SQLAlchemy(app)
 
 keyspace_mapping = app.config["MAPPING"]
+fast_json = app.config.get("FAST_JSON", False)
 
 import authmodel
 
+metrics.init_app(app, gd.cache_stats, lambda: gd.all_exchange_rates)
 db.create_all()
+revoked_tokens = authmodel.RevokedTokenSet(app.config.get("REVOKED_TOKENS_SYNC_INTERVAL", 5))
+with app.app_context():
+    revoked_tokens.sync()
 
 '''
     Methods related to swagger argument parsing
@@ -81,12 +93,23 @@ limit_parser.add_argument("limit", type=int, location="args")
 limit_offset_parser = limit_parser.copy()
 limit_offset_parser.add_argument("offset", type=int, location="args")
 
+exchange_rates_parser = limit_offset_parser.copy()
+exchange_rates_parser.add_argument("from_height", type=int, location="args")
+exchange_rates_parser.add_argument("to_height", type=int, location="args")
+exchange_rates_parser.add_argument("step", type=int, location="args")
+
 limit_query_parser = limit_parser.copy()
 limit_query_parser.add_argument("q", location="args")
 
 limit_direction_parser = limit_parser.copy()
 limit_direction_parser.add_argument("direction", location="args")
 
+limit_stream_parser = limit_parser.copy()
+limit_stream_parser.add_argument("stream", type=int, location="args")
+
+limit_direction_stream_parser = limit_direction_parser.copy()
+limit_direction_stream_parser.add_argument("stream", type=int, location="args")
+
 direction_parser = api.parser()
 direction_parser.add_argument("direction", location="args")
 
@@ -116,8 +139,7 @@ def revoked_token_callback():
 
 @jwt.token_in_blacklist_loader
 def check_if_token_in_blacklist(decrypted_token):
-    jti = decrypted_token["jti"]
-    return authmodel.RevokedJWTToken.is_jti_blacklisted(jti)
+    return decrypted_token["jti"] in revoked_tokens
 
 
 def auth_required(f):
@@ -164,8 +186,7 @@ class UserLogoutRefresh(Resource):
     def get(self):
         jti = get_raw_jwt()["jti"]
         try:
-            revoked_token = authmodel.RevokedJWTToken(jti=jti)
-            revoked_token.add()
+            revoked_tokens.revoke(jti)
             return {"message": "Refresh token has been revoked!"}, 200
         except:
             return {"message": "Something went wrong"}, 500
@@ -177,8 +198,7 @@ class UserLogoutAccess(Resource):
     def get(self):
         jti = get_raw_jwt()["jti"]
         try:
-            revoked_token = authmodel.RevokedJWTToken(jti=jti)
-            revoked_token.add()
+            revoked_tokens.revoke(jti)
             return {"message": "Access token has been revoked!"}, 200
         except:
             return {"message": "Something went wrong"}, 500
@@ -201,11 +221,7 @@ class Statistics(Resource):
         """
         Returns a JSON with statistics of all the available currencies
         """
-        statistics = dict()
-        for currency in keyspace_mapping.keys():
-            if currency != "tagpacks":
-                statistics[currency] = gd.query_statistics(currency)
-        return statistics
+        return gd.cached_statistics()
 
 exchangerate = api.model("exchangerate", {
     "eur": fields.Float(required=True, description="EUR"),
@@ -213,29 +229,172 @@ exchangerate = api.model("exchangerate", {
 })
 
 exchangerates_response = api.model("exchangerates_response", {
-    "exchangeRates": fields.List(fields.Nested(exchangerate), required=True, description="List with exchange rates")
+    "exchangeRates": fields.List(fields.Nested(exchangerate), required=False, description="List with exchange rates"),
+    "fromHeight": fields.Integer(required=False, description="First height of the range"),
+    "toHeight": fields.Integer(required=False, description="Last height of the range"),
+    "step": fields.Integer(required=False, description="Height step of the range"),
+    "eur": fields.List(fields.Float, required=False, description="EUR rates of the range"),
+    "usd": fields.List(fields.Float, required=False, description="USD rates of the range")
 })
 
 
+def int_arg(name):
+    value = request.args.get(name)
+    if value is not None:
+        try:
+            value = int(value)
+        except Exception:
+            abort(404, "Invalid %s value" % name)
+    return value
+
+
+def export_args():
+    """limit and pagesize of an export of all rows, both positive."""
+    limit = int_arg("limit")
+    if limit is not None and limit <= 0:
+        abort(404, "Invalid limit value")
+    pagesize = int_arg("pagesize")
+    if pagesize is not None and pagesize <= 0:
+        abort(404, "Invalid pagesize value")
+    return (limit, pagesize or stream_pagesize)
+
+
+def ndjson_requested():
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def stream_requested():
+    return request.args.get("stream") == "1" or ndjson_requested()
+
+
+def shape(data, model):
+    """Return data shaped like the response model. With FAST_JSON this
+    uses a shaper compiled from model instead of marshal."""
+    if fast_json:
+        return fastjson.shaper(model)(data)
+    return marshal(data, model)
+
+
+def dumps(data):
+    if fast_json:
+        return fastjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+def json_response(data, model):
+    """Response of data shaped like model, for handlers documenting model
+    with @api.response. With FAST_JSON it is encoded directly instead of
+    being passed on to flask-restplus."""
+    if fast_json:
+        return Response(dumps(shape(data, model)), mimetype="application/json")
+    return marshal(data, model)
+
+
+def msgpack_requested():
+    return request.accept_mimetypes.best == columnar.MIMETYPE
+
+
+def columnar_response(data):
+    if columnar.msgpack is None:
+        abort(406, "MessagePack responses are not available")
+    return Response(columnar.dumps(data), mimetype=columnar.MIMETYPE)
+
+
+def page_response(next_page, list_name, rows, model):
+    """Response of a page of rows, shaped like model. With Accept:
+    application/x-msgpack the rows are sent as MessagePack columns."""
+    if msgpack_requested():
+        return columnar_response({
+            "nextPage": next_page,
+            list_name: columnar.columns(rows, model[list_name].container.nested)})
+    return json_response({"nextPage": next_page, list_name: rows}, model)
+
+
+def stream_pages(query_page, page_state, item_to_json, list_name, ndjson):
+    """Stream all rows following page_state, fetching one page of rows at
+    a time with query_page(page_state) -> (page_state, rows).
+
+    Rows are written as NDJSON lines or as a JSON document shaped like the
+    paged response. The first page is fetched before the response starts,
+    so that its errors, e.g. an unknown currency, get their status code."""
+
+    def generate(page):
+        if not ndjson:
+            yield b'{"nextPage": null, "%s": [' % list_name.encode()
+        separator = b""
+        while True:
+            (page_state, rows) = page
+            for row in rows:
+                item = dumps(item_to_json(row))
+                if ndjson:
+                    yield item + b"\n"
+                else:
+                    yield separator + item
+                    separator = b","
+            if not page_state:
+                break
+            page = query_page(page_state)
+        if not ndjson:
+            yield b"]}"
+
+    return Response(generate(query_page(page_state)),
+                    mimetype="application/x-ndjson" if ndjson else "application/json")
+
+
 @api.route("/<currency>/exchangerates")
 class ExchangeRates(Resource):
     @jwt_required
-    @api.doc(parser=limit_offset_parser)
-    @api.marshal_with(exchangerates_response)
+    @api.doc(parser=exchange_rates_parser)
+    @api.response(200, "Success", exchangerates_response)
     def get(self, currency):
         """
         Returns a JSON with exchange rates
+
+        With from_height, to_height or step the rates of that height range
+        are returned as eur and usd arrays, otherwise as a list of limit
+        rates per page (offset), starting at the latest height.
+        With Accept: application/x-msgpack they are returned as
+        MessagePack columns.
         """
         manual_limit = 100000
-        limit = request.args.get("limit")
-        offset = request.args.get("offset")
-        if offset and not isinstance(offset, int):
-            abort(404, "Invalid offset")
-        if limit and (not isinstance(offset, int) or limit > manual_limit):
-            abort(404, "Invalid limit")
-
-        exchange_rates = gd.query_exchange_rates(currency, offset, limit)
-        return {"exchangeRates": exchange_rates}
+        from_height = int_arg("from_height")
+        to_height = int_arg("to_height")
+        step = int_arg("step")
+        if from_height is None and to_height is None and step is None:
+            limit = int_arg("limit")
+            offset = int_arg("offset")
+            if offset is not None and offset < 0:
+                abort(404, "Invalid offset")
+            if limit is not None and (limit <= 0 or limit > manual_limit):
+                abort(404, "Invalid limit")
+            exchange_rates = gd.query_exchange_rates(currency, offset, limit)
+            if msgpack_requested():
+                return columnar_response({"exchangeRates": {
+                    "eur": [rate["eur"] for rate in exchange_rates],
+                    "usd": [rate["usd"] for rate in exchange_rates]}})
+            return Response(json.dumps({"exchangeRates": exchange_rates}),
+                            mimetype="application/json")
+
+        from_height = from_height or 0
+        step = step or 1
+        if from_height < 0 or step <= 0:
+            abort(404, "Invalid height range")
+        if to_height is None:
+            to_height = from_height + (manual_limit - 1) * step
+        if to_height < from_height or (to_height - from_height) // step >= manual_limit:
+            abort(404, "Invalid height range")
+
+        (eur, usd) = gd.query_exchange_rate_columns(currency, from_height, to_height, step)
+        columns = {
+            "fromHeight": from_height,
+            "toHeight": from_height + (len(eur) - 1) * step if len(eur) else None,
+            "step": step,
+            "eur": eur.tolist(),
+            "usd": usd.tolist()
+        }
+        if msgpack_requested():
+            return columnar_response(columns)
+        return Response(json.dumps(columns), mimetype="application/json")
 
 
 block_response = api.model("block_response", {
@@ -298,15 +457,22 @@ block_transactions_response = api.model("block_transactions_response", {
 @api.route("/<currency>/block/<int:height>/transactions")
 class BlockTransactions(Resource):
     @jwt_required
-    @api.marshal_with(block_transactions_response)
+    @api.response(200, "Success", block_transactions_response)
     def get(self, currency, height):
         """
         Returns a JSON with all the transactions of the block
+
+        With Accept: application/x-msgpack the transactions are returned
+        as MessagePack columns
         """
         block_transactions = gd.query_block_transactions(currency, height)
         if not block_transactions:
             abort(404, "Block height %d not found" % height)
-        return block_transactions
+        if msgpack_requested():
+            return columnar_response({
+                "height": block_transactions.height,
+                "txs": columnar.columns(block_transactions.txs, block_transaction_response)})
+        return json_response(block_transactions, block_transactions_response)
 
 
 def transactionsToCSV(jsonData):
@@ -341,7 +507,7 @@ class BlockTransactionsCSV(Resource):
         block_transactions = gd.query_block_transactions(currency, height)
         if not block_transactions:
             abort(404, "Block height %d not found" % height)
-        return Response(transactionsToCSV(block_transactions), mimetype="text/csv")
+        return Response(transactionsToCSV(block_transactions.to_dict()), mimetype="text/csv")
 
 input_output_response = api.model("input_output_response", {
     "address": fields.String(required=True, description="Address"),
@@ -417,12 +583,6 @@ class Search(Resource):
         expression = request.args.get("q")
         if not expression:
             abort(404, "Expression parameter not provided")
-        leading_zeros = 0
-        pos = 0
-        # leading zeros will be lost when casting to int
-        while expression[pos] == "0":
-            pos += 1
-            leading_zeros += 1
         limit = request.args.get("limit")
         if not limit:
             limit = 50
@@ -436,14 +596,8 @@ class Search(Resource):
 
         # Look addresses and transactions
         if len(expression) >= address_prefix_len:
-            transactions = gd.query_transaction_search(currency, expression[:transaction_prefix_len])
-            addresses = gd.query_address_search(currency, expression[:address_prefix_len])
-
-            result["addresses"] = \
-                [row.address for row in addresses.current_rows if row.address.startswith(expression)][:limit]
-            result["transactions"] = \
-                [tx for tx in ["0"*leading_zeros + str(hex(int.from_bytes(row.tx_hash, byteorder="big")))[2:]
-                               for row in transactions.current_rows] if tx.startswith(expression)][:limit]
+            result["addresses"] = gd.search_addresses(currency, expression, limit)
+            result["transactions"] = gd.search_transactions(currency, expression, limit)
 
         return result
 
@@ -465,12 +619,6 @@ class LabelSearch(Resource):
         expression = request.args.get("q")
         if not expression:
             abort(404, "Expression parameter not provided")
-        leading_zeros = 0
-        pos = 0
-        # leading zeros will be lost when casting to int
-        while expression[pos] == "0":
-            pos += 1
-            leading_zeros += 1
         limit = request.args.get("limit")
         if not limit:
             limit = 50
@@ -485,12 +633,9 @@ class LabelSearch(Resource):
         # Normalize label
         if len(expression) >= label_prefix_len:  # must be label_prefix_len <= address_prefix_len
             expression_norm = alphanumeric_lower(expression)
-            expression_norm_prefix = expression_norm[:label_prefix_len]
-            labels = gd.query_label_search(expression_norm_prefix)
 
-            # Look for labels
-            result["labels"] = list(dict.fromkeys(
-                [row.label for row in labels.current_rows if row.label_norm.startswith(expression_norm)][:limit]))
+            # Look for labels, the ones with most addresses first
+            result["labels"] = gd.search_labels(expression_norm, limit)
 
         return result
 
@@ -644,11 +789,16 @@ address_transactions_response = api.model("address_transactions_response", {
 @api.route("/<currency>/address/<address>/transactions")
 class AddressTransactions(Resource):
     @jwt_required
-    @api.doc(parser=limit_parser)
-    @api.marshal_with(address_transactions_response)
+    @api.doc(parser=limit_stream_parser)
+    @api.response(200, "Success", address_transactions_response)
     def get(self, currency, address):
         """
         Returns a JSON with the transactions of the address
+
+        With stream=1 or Accept: application/x-ndjson all transactions
+        following page are streamed
+        With Accept: application/x-msgpack the page is returned as
+        MessagePack columns
         """
         if not address:
             abort(404, "Address not provided")
@@ -669,15 +819,80 @@ class AddressTransactions(Resource):
         page = request.args.get("page")
         page_state = bytes.fromhex(page) if page else None
 
-        (page_state, rows) = gd.query_address_transactions(currency, page_state, address, pagesize, limit)
-        txs = [gm.AddressTransactions(
-                   row, gd.query_exchange_rate_for_height(currency, row.height)
-               ).__dict__
-               for row in rows]
-        return {
-            "nextPage": page_state.hex() if page_state else None,
-            "transactions": txs
-        }
+        if stream_requested():
+            return stream_pages(
+                lambda page_state: gd.query_address_transactions(currency, page_state, address, pagesize or stream_pagesize, limit),
+                page_state,
+                lambda row: shape(row, address_transaction_response),
+                "transactions", ndjson_requested())
+
+        (page_state, txs) = gd.query_address_transactions(currency, page_state, address, pagesize, limit)
+        return page_response(page_state.hex() if page_state else None, "transactions",
+                             txs, address_transactions_response)
+
+
+def addressTransactionsToCSV(currency, address, pagesize, limit, page_state=None):
+    """CSV lines of all transactions of the address. The first page is
+    fetched right away, so that its errors get their status code."""
+
+    def generate(page):
+        fieldnames = []
+        flatDict = {}
+        while True:
+            (page_state, rows) = page
+
+            def flatten(item, name=""):
+                if type(item) is dict:
+                    for sub_item in item:
+                        flatten(item[sub_item], name + sub_item + "_")
+                else:
+                    flatDict[name[:-1]] = item
+
+            for row in rows:
+                flatten(row.to_dict())
+                if not fieldnames:
+                    fieldnames = ",".join(flatDict.keys())
+                    yield (fieldnames + "\n")
+                yield (",".join([str(item) for item in flatDict.values()]) + "\n")
+                flatDict = {}
+
+            if not page_state:
+                break
+            page = gd.query_address_transactions(currency, page_state, address, pagesize, limit)
+
+    return generate(gd.query_address_transactions(currency, page_state, address, pagesize, limit))
+
+
+@api.route("/<currency>/address/<address>/transactions.csv")
+class AddressTransactionsCSV(Resource):
+    @jwt_required
+    @api.doc(parser=limit_parser)
+    def get(self, currency, address):
+        """
+        Returns a CSV with all transactions of the address
+        """
+        if not address:
+            abort(404, "Address not provided")
+        (limit, pagesize) = export_args()
+        return Response(addressTransactionsToCSV(currency, address, pagesize, limit), mimetype="text/csv")
+
+
+@api.route("/<currency>/address/<address>/transactions.ndjson")
+class AddressTransactionsNDJSON(Resource):
+    @jwt_required
+    @api.doc(parser=limit_parser)
+    def get(self, currency, address):
+        """
+        Returns all transactions of the address as newline delimited JSON
+        """
+        if not address:
+            abort(404, "Address not provided")
+        (limit, pagesize) = export_args()
+        return stream_pages(
+            lambda page_state: gd.query_address_transactions(currency, page_state, address, pagesize, limit),
+            None,
+            lambda row: shape(row, address_transaction_response),
+            "transactions", True)
 
 
 @api.route("/<currency>/address/<address>/implicitTags")
@@ -752,10 +967,7 @@ class AddressClusterWithTags(Resource):
         if not address:
             abort(404, "Address not provided")
 
-        address_cluster = gd.query_address_cluster(currency, address)
-        if "cluster" in address_cluster:
-            address_cluster["tags"] = gd.query_cluster_tags(currency, address_cluster["cluster"])
-        return address_cluster
+        return gd.query_address_cluster_with_tags(currency, address)
 
 
 neighbor_response = api.model("neighbor_response", {
@@ -776,11 +988,16 @@ neighbors_response = api.model("address_neighbors_response", {
 @api.route("/<currency>/address/<address>/neighbors")
 class AddressNeighbors(Resource):
     @jwt_required
-    @api.doc(parser=limit_direction_parser)
-    @api.marshal_with(neighbors_response)
+    @api.doc(parser=limit_direction_stream_parser)
+    @api.response(200, "Success", neighbors_response)
     def get(self, currency, address):
         """
         Returns a JSON with edges and nodes of the address
+
+        With stream=1 or Accept: application/x-ndjson all neighbors
+        following page are streamed
+        With Accept: application/x-msgpack the page is returned as
+        MessagePack columns
         """
         direction = request.args.get("direction")
         if not direction:
@@ -810,11 +1027,20 @@ class AddressNeighbors(Resource):
         page_state = bytes.fromhex(page) if page else None
 
         if isOutgoing:
-            (page_state, rows) = gd.query_address_outgoing_relations(currency, page_state, address, pagesize, limit)
+            query_function = gd.query_address_outgoing_relations
         else:
-            (page_state, rows) = gd.query_address_incoming_relations(currency, page_state, address, pagesize, limit)
-        return {"nextPage": page_state.hex() if page_state else None,
-                "neighbors": [row.toJson() for row in rows]}
+            query_function = gd.query_address_incoming_relations
+
+        if stream_requested():
+            return stream_pages(
+                lambda page_state: query_function(currency, page_state, address, pagesize or stream_pagesize, limit),
+                page_state,
+                lambda row: shape(row.toJson(), neighbor_response),
+                "neighbors", ndjson_requested())
+
+        (page_state, rows) = query_function(currency, page_state, address, pagesize, limit)
+        return page_response(page_state.hex() if page_state else None, "neighbors",
+                             [row.toJson() for row in rows], neighbors_response)
 
 
 def neighboursToCSV(query_function, currency, cluster, pagesize, limit, page_state = None):
@@ -912,10 +1138,9 @@ class ClusterWithTags(Resource):
         """
         if not cluster:
             abort(404, "Cluster id not provided")
-        cluster_obj = gd.query_cluster(currency, cluster)
+        cluster_obj = gd.query_cluster_with_tags(currency, cluster)
         if not cluster_obj:
             abort(404, "Cluster not found")
-        cluster_obj.tags = gd.query_cluster_tags(currency, cluster)
         return cluster_obj
 
 
@@ -972,7 +1197,7 @@ cluster_address_response = api.model("cluster_address_response", {
     "totalSpent": fields.Nested(value_response, required=True)
 })
 
-address_transactions_response = api.model("address_transactions_response", {
+cluster_addresses_response = api.model("cluster_addresses_response", {
     "nextPage": fields.String(required=True, description="The next page"),
     "addresses": fields.List(fields.Nested(cluster_address_response), required=True, description="The list of cluster adresses")
 })
@@ -980,11 +1205,16 @@ address_transactions_response = api.model("address_transactions_response", {
 @api.route("/<currency>/cluster/<cluster>/addresses")
 class ClusterAddresses(Resource):
     @jwt_required
-    @api.doc(parser=limit_parser)
-    @api.marshal_with(address_transactions_response)
+    @api.doc(parser=limit_stream_parser)
+    @api.response(200, "Success", cluster_addresses_response)
     def get(self,currency, cluster):
         """
         Returns a JSON with the details of the addresses in the cluster
+
+        With stream=1 or Accept: application/x-ndjson all addresses
+        following page are streamed
+        With Accept: application/x-msgpack the page is returned as
+        MessagePack columns
         """
         if not cluster:
             abort(404, "Cluster not provided")
@@ -1006,19 +1236,32 @@ class ClusterAddresses(Resource):
                 abort(404, "Invalid pagesize value")
         page = request.args.get("page")
         page_state = bytes.fromhex(page) if page else None
+        if stream_requested():
+            return stream_pages(
+                lambda page_state: gd.query_cluster_addresses(currency, cluster, page_state, pagesize or stream_pagesize, limit),
+                page_state,
+                lambda address: shape(address, cluster_address_response),
+                "addresses", ndjson_requested())
+
         (page, addresses) = gd.query_cluster_addresses(
             currency, cluster, page_state, pagesize, limit)
-        return {"nextPage": page.hex() if page is not None else None, "addresses": addresses}
+        return page_response(page.hex() if page is not None else None, "addresses",
+                             addresses, cluster_addresses_response)
 
 
 @api.route("/<currency>/cluster/<cluster>/neighbors")
 class ClusterNeighbors(Resource):
     @jwt_required
-    @api.doc(parser=limit_direction_parser)
-    @api.marshal_with(neighbors_response)
+    @api.doc(parser=limit_direction_stream_parser)
+    @api.response(200, "Success", neighbors_response)
     def get(self, currency, cluster):
         """
         Returns a JSON with edges and nodes of the cluster
+
+        With stream=1 or Accept: application/x-ndjson all neighbors
+        following page are streamed
+        With Accept: application/x-msgpack the page is returned as
+        MessagePack columns
         """
         direction = request.args.get("direction")
         if not direction:
@@ -1048,12 +1291,20 @@ class ClusterNeighbors(Resource):
         page_state = bytes.fromhex(page) if page else None
 
         if isOutgoing:
-            (page_state, rows) = gd.query_cluster_outgoing_relations(currency, page_state, cluster, pagesize, limit)
+            query_function = gd.query_cluster_outgoing_relations
         else:
-            (page_state, rows) = gd.query_cluster_incoming_relations(currency, page_state, cluster, pagesize, limit)
+            query_function = gd.query_cluster_incoming_relations
+
+        if stream_requested():
+            return stream_pages(
+                lambda page_state: query_function(currency, page_state, cluster, pagesize or stream_pagesize, limit),
+                page_state,
+                lambda row: shape(row.toJson(), neighbor_response),
+                "neighbors", ndjson_requested())
 
-        return {"nextPage": page_state.hex() if page_state else None,
-                "neighbors": [row.toJson() for row in rows]}
+        (page_state, rows) = query_function(currency, page_state, cluster, pagesize, limit)
+        return page_response(page_state.hex() if page_state else None, "neighbors",
+                             [row.toJson() for row in rows], neighbors_response)
 
 
 @api.route("/<currency>/cluster/<cluster>/neighbors.csv")
@@ -1154,7 +1405,8 @@ def search_neighbors_recursive(depth = 7):
 
 maxdepth = 7
 search_neighbors_response = api.model("search_neighbors_response_depth_" + str(maxdepth), {
-        "paths": fields.List(fields.Nested(search_neighbors_recursive(maxdepth), required=True))
+        "paths": fields.List(fields.Nested(search_neighbors_recursive(maxdepth), required=True)),
+        "truncated": fields.Boolean(required=True, description="Search stopped early, paths are incomplete")
     })
 
 
@@ -1188,10 +1440,125 @@ class ClusterSearchNeighbors(Resource):
         category = request.args.get("category")
         ids = request.args.get("addresses")
         if ids:
-            ids = [ {"address" : address, "cluster" : gd.query_address_cluster_id(currency, address)} for address in ids.split(",")]
+            addresses = list(dict.fromkeys(ids.split(",")))
+            max_addresses = gd.search_budget.get("MAX_ADDRESSES", 100)
+            if len(addresses) > max_addresses:
+                abort(400, "At most %d addresses per search" % max_addresses)
+            clusters = gd.query_address_cluster_ids(currency, addresses)
+            ids = [{"address": address, "cluster": clusters[address]} for address in addresses]
+
+        (result, truncated) = gd.query_cluster_search_neighbors(currency, cluster, isOutgoing, category, ids, breadth, depth)
+        return {"paths": result, "truncated": truncated}
+
+
+def batch_ids(name):
+    body = request.get_json(silent=True) or {}
+    ids = body.get(name)
+    if not isinstance(ids, list) or not ids:
+        abort(400, "List of %s not provided" % name)
+    if len(ids) > batch_limit:
+        abort(400, "At most %d %s per request" % (batch_limit, name))
+    return [str(id) for id in ids]
+
 
-        result = gd.query_cluster_search_neighbors(currency, cluster, isOutgoing, category, ids, breadth, depth)
-        return {"paths": result}
+def is_cluster_id(cluster):
+    # str.isdigit() also accepts digits like "²" that int() rejects
+    return re.fullmatch("[0-9]+", cluster) is not None
+
+
+def batch_item(id, result, error):
+    if isinstance(result, Exception):
+        (result, error) = (None, "Query failed: %s" % result)
+    if result is None and error is None:
+        error = "Not found"
+    return {"id": id, "result": result, "error": error}
+
+
+addresses_request = api.model("addresses_request", {
+    "addresses": fields.List(fields.String, required=True, description="Addresses")
+})
+
+transactions_request = api.model("transactions_request", {
+    "transactions": fields.List(fields.String, required=True, description="Transaction hashes")
+})
+
+clusters_request = api.model("clusters_request", {
+    "clusters": fields.List(fields.String, required=True, description="Cluster ids")
+})
+
+batch_addresses_response = api.model("batch_addresses_response", {
+    "items": fields.List(fields.Nested(api.model("batch_address_response", {
+        "id": fields.String(required=True, description="Address"),
+        "result": fields.Nested(address_response, allow_null=True, description="Address details"),
+        "error": fields.String(description="Error message")
+    })), required=True, description="Results in the order of the request")
+})
+
+batch_transactions_response = api.model("batch_transactions_response", {
+    "items": fields.List(fields.Nested(api.model("batch_transaction_response", {
+        "id": fields.String(required=True, description="Transaction hash"),
+        "result": fields.Nested(transaction_response, allow_null=True, description="Transaction details"),
+        "error": fields.String(description="Error message")
+    })), required=True, description="Results in the order of the request")
+})
+
+batch_clusters_response = api.model("batch_clusters_response", {
+    "items": fields.List(fields.Nested(api.model("batch_cluster_response", {
+        "id": fields.String(required=True, description="Cluster id"),
+        "result": fields.Nested(cluster_response, allow_null=True, description="Cluster details"),
+        "error": fields.String(description="Error message")
+    })), required=True, description="Results in the order of the request")
+})
+
+
+@api.route("/<currency>/batch/addresses")
+class BatchAddresses(Resource):
+    @jwt_required
+    @api.expect(addresses_request)
+    @api.marshal_with(batch_addresses_response)
+    def post(self, currency):
+        """
+        Returns a JSON with the details of each address in the list
+        """
+        addresses = batch_ids("addresses")
+        results = gd.query_addresses(currency, list(dict.fromkeys(addresses)))
+        return {"items": [batch_item(address, results[address], None)
+                          for address in addresses]}
+
+
+@api.route("/<currency>/batch/transactions")
+class BatchTransactions(Resource):
+    @jwt_required
+    @api.expect(transactions_request)
+    @api.marshal_with(batch_transactions_response)
+    def post(self, currency):
+        """
+        Returns a JSON with the details of each transaction in the list
+        """
+        tx_hashes = batch_ids("transactions")
+        valid = [tx_hash for tx_hash in dict.fromkeys(tx_hashes)
+                 if re.fullmatch("[0-9a-fA-F]+", tx_hash) and len(tx_hash) % 2 == 0]
+        results = gd.query_transactions_by_hash(currency, valid)
+        return {"items": [batch_item(tx_hash, results[tx_hash], None) if tx_hash in results
+                          else batch_item(tx_hash, None, "Transaction hash is not hex")
+                          for tx_hash in tx_hashes]}
+
+
+@api.route("/<currency>/batch/clusters")
+class BatchClusters(Resource):
+    @jwt_required
+    @api.expect(clusters_request)
+    @api.marshal_with(batch_clusters_response)
+    def post(self, currency):
+        """
+        Returns a JSON with the details of each cluster in the list
+        """
+        clusters = batch_ids("clusters")
+        valid = [cluster for cluster in dict.fromkeys(clusters) if is_cluster_id(cluster)]
+        results = gd.query_clusters(currency, valid)
+        return {"items": [batch_item(cluster, results[int(cluster)], None) if is_cluster_id(cluster)
+                          else batch_item(cluster, None, "Invalid cluster ID")
+                          for cluster in clusters]}
 
 
 @app.errorhandler(400)
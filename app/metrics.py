@@ -0,0 +1,143 @@
+import os
+import re
+import time
+from flask import g, request
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+
+# set for uWSGI, so the metrics of all workers are aggregated from files
+# in this directory; it must exist and be emptied before the workers start
+multiprocess_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+if prometheus_client is not None:
+    request_seconds = prometheus_client.Histogram(
+        "graphsense_request_seconds",
+        "Time until the response of a request is ready",
+        ["endpoint", "method", "status"])
+    requests_in_flight = prometheus_client.Gauge(
+        "graphsense_requests_in_flight", "Requests being handled per worker",
+        multiprocess_mode="liveall")
+    query_seconds = prometheus_client.Histogram(
+        "graphsense_query_seconds",
+        "Time until the first page of a Cassandra query is received",
+        ["statement"])
+    query_rows = prometheus_client.Histogram(
+        "graphsense_query_rows", "Rows of the first page of a Cassandra query",
+        ["statement"], buckets=(0, 1, 10, 100, 1000, 10000, 100000, float("inf")))
+    query_errors = prometheus_client.Counter(
+        "graphsense_query_errors", "Failed Cassandra queries", ["statement"])
+    cache_hits = prometheus_client.Gauge(
+        "graphsense_cache_hits", "Cache hits since the worker started",
+        ["entity"], multiprocess_mode="livesum")
+    cache_misses = prometheus_client.Gauge(
+        "graphsense_cache_misses", "Cache misses since the worker started",
+        ["entity"], multiprocess_mode="livesum")
+    cache_size = prometheus_client.Gauge(
+        "graphsense_cache_entries", "Cached entries", ["entity"],
+        multiprocess_mode="livesum")
+    exchange_rate_heights = prometheus_client.Gauge(
+        "graphsense_exchange_rate_heights", "Heights in the exchange rate store",
+        ["currency"], multiprocess_mode="max")
+    exchange_rate_bytes = prometheus_client.Gauge(
+        "graphsense_exchange_rate_bytes", "Size of the exchange rate store",
+        ["currency"], multiprocess_mode="max")
+
+
+def observe_query(name, future):
+    """Record latency and row count of the first page of future, the
+    ResponseFuture of the statement called name."""
+    if prometheus_client is None:
+        return
+    start = time.perf_counter()
+    observed = []
+
+    def on_rows(rows):
+        if not observed:
+            observed.append(True)
+            query_seconds.labels(name).observe(time.perf_counter() - start)
+            query_rows.labels(name).observe(len(rows))
+
+    def on_error(error):
+        query_errors.labels(name).inc()
+    future.add_callbacks(on_rows, on_error)
+
+
+def init_app(app, cache_stats, rate_stores):
+    """Record the latency and in-flight count of the requests of app, and
+    with each response the cache_stats() of the worker. rate_stores() are
+    the exchange rate stores by currency, reported by /metrics."""
+    if prometheus_client is None:
+        return
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        requests_in_flight.inc()
+
+    @app.after_request
+    def observe_request(response):
+        if "request_start" in g:
+            request_seconds.labels(request.endpoint or "unknown", request.method,
+                                   response.status_code) \
+                .observe(time.perf_counter() - g.request_start)
+        for (entity, stats) in cache_stats().items():
+            cache_hits.labels(entity).set(stats["hits"])
+            cache_misses.labels(entity).set(stats["misses"])
+            cache_size.labels(entity).set(stats["size"])
+        return response
+
+    @app.teardown_request
+    def end_request(exception):
+        if "request_start" in g:
+            requests_in_flight.dec()
+
+    @app.route("/metrics")
+    def metrics():
+        for (currency, store) in rate_stores().items():
+            exchange_rate_heights.labels(currency).set(len(store))
+            exchange_rate_bytes.labels(currency).set(store.rates.nbytes)
+        return (latest(), 200, {"Content-Type": prometheus_client.CONTENT_TYPE_LATEST})
+
+
+def mark_process_dead(pid=None):
+    """Drop the live gauges of the worker pid, by default of this process,
+    when it exits, so that they no longer count in the totals."""
+    if prometheus_client is None or not multiprocess_dir:
+        return
+    multiprocess.mark_process_dead(pid or os.getpid(), multiprocess_dir)
+
+
+def mark_dead_workers():
+    """Drop the live gauges of workers that exited without calling
+    mark_process_dead, e.g. after a crash."""
+    if prometheus_client is None or not multiprocess_dir:
+        return
+    for name in os.listdir(multiprocess_dir):
+        match = re.fullmatch(r"gauge_live\w+_(\d+)\.db", name)
+        if match and not process_alive(int(match.group(1))):
+            mark_process_dead(int(match.group(1)))
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def latest():
+    """Metrics in the Prometheus text format, of all workers if
+    multiprocess_dir is set."""
+    if multiprocess_dir:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, multiprocess_dir)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry)
@@ -0,0 +1,158 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+# column order of the rate arrays
+EUR = 0
+USD = 1
+ROW_SIZE = 2 * np.dtype(np.float64).itemsize
+
+
+class ExchangeRateStore(object):
+    """Exchange rates of one currency as a float64 array of shape
+    (no_heights, 2) indexed by block height. The array is a read-only
+    memory map of a file shared by all worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rates = map_rates(path)
+
+    def __len__(self):
+        return self.rates.shape[0]
+
+    def __getitem__(self, height):
+        row = self.rates[height]
+        return {"eur": float(row[EUR]), "usd": float(row[USD])}
+
+    @property
+    def max_height(self):
+        return len(self) - 1
+
+    def extend(self, h_max, load):
+        """Extend the store up to h_max with rows from load(h_min, h_max).
+
+        Only heights missing from the shared file are loaded; if another
+        worker already extended it, the file is just mapped again. The new
+        array replaces the old one in a single assignment, so readers see
+        either the old or the extended rates."""
+        with locked(self.path):
+            h_min = stored_heights(self.path)
+            if h_min <= h_max:
+                append_rates(self.path, h_min, h_max, load(h_min, h_max))
+            self.rates = map_rates(self.path)
+
+    def rebuild(self, max_age, h_max, load):
+        """Rebuild the file from load(h_max) if it was built more than
+        max_age seconds ago, so that rates corrected in Cassandra replace
+        the stored ones. If another worker rebuilt it in the meantime, the
+        file is just mapped again."""
+        with locked(self.path):
+            if time.time() - built_at(self.path) >= max_age:
+                write_rates(self.path, h_max, load(h_max))
+            self.rates = map_rates(self.path)
+
+
+def map_rates(path):
+    if not os.path.getsize(path):
+        return np.zeros((0, 2), dtype=np.float64)
+    return np.memmap(path, dtype=np.float64, mode="r").reshape(-1, 2)
+
+
+def stored_heights(path):
+    if not os.path.exists(path):
+        return 0
+    return os.path.getsize(path) // ROW_SIZE
+
+
+def built_at(path):
+    """Time the file at path was last written in full, 0 if unknown."""
+    try:
+        return os.path.getmtime(path + ".built")
+    except OSError:
+        return 0
+
+
+def rates_array(h_min, h_max, rows):
+    """Rates of heights h_min..h_max from (height, eur, usd) rows.
+
+    Raises ValueError if a height is missing, so that a gap is never
+    stored as a zero rate."""
+    rates = np.zeros((h_max - h_min + 1, 2), dtype=np.float64)
+    found = np.zeros(h_max - h_min + 1, dtype=bool)
+    for (height, eur, usd) in rows:
+        if h_min <= height <= h_max:
+            rates[height - h_min] = (eur, usd)
+            found[height - h_min] = True
+    if not found.all():
+        missing = np.flatnonzero(~found) + h_min
+        raise ValueError("No exchange rates for %d heights, first %d"
+                         % (len(missing), missing[0]))
+    return rates
+
+
+def write_rates(path, h_max, rows):
+    """Write (height, eur, usd) rows for heights 0..h_max to path.
+
+    The file is replaced atomically, so workers still mapping the old
+    file keep a consistent view until they reopen the store."""
+    rates = rates_array(0, h_max, rows)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as fp:
+        rates.tofile(fp)
+    os.replace(tmp_path, path)
+    with open(path + ".built", "w"):
+        pass
+    os.utime(path + ".built")
+
+
+def append_rates(path, h_min, h_max, rows):
+    """Write rows for heights h_min..h_max at the end of the file at path.
+
+    Mapped regions of the file stay valid, and a partially written row
+    from an interrupted append is overwritten by the next one."""
+    rates = rates_array(h_min, h_max, rows)
+    with open(path, "r+b") as fp:
+        fp.seek(h_min * ROW_SIZE)
+        rates.tofile(fp)
+        fp.truncate()
+
+
+@contextmanager
+def locked(path):
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def store_path(directory, name):
+    return os.path.join(directory, "%s.rates" % name)
+
+
+def stored_max_height(directory, name):
+    """Highest height in the rate file of keyspace `name`, 0 if none."""
+    return max(stored_heights(store_path(directory, name)) - 1, 0)
+
+
+def open_store(directory, name, h_max, load, load_range):
+    """Return the store for keyspace `name` covering heights 0..h_max.
+
+    If the rate file is missing or empty, or was written before its
+    build time was recorded, it is built from load(h_max), which returns
+    (height, eur, usd) rows; if it ends below h_max, only
+    the missing heights are appended from load_range(h_min, h_max).
+    Workers serialize on a lock file, so only the first one queries
+    Cassandra and all others map the file it wrote."""
+    os.makedirs(directory, exist_ok=True)
+    path = store_path(directory, name)
+    with locked(path):
+        if not stored_heights(path) or not built_at(path):
+            write_rates(path, h_max, load(h_max))
+    store = ExchangeRateStore(path)
+    store.extend(h_max, load_range)
+    return store
@@ -0,0 +1,209 @@
+import bisect
+import heapq
+import mmap
+import os
+import tempfile
+import numpy as np
+
+
+class PrefixIndex(object):
+    """Sorted, distinct keys in a memory-mapped index file, searched by
+    prefix with a binary search followed by a range scan.
+
+    The file holds the keys up to the block height it was built at; keys
+    of later blocks are added in memory with extend.
+
+    File layout: the keys, each terminated by a newline, padded to a
+    multiple of 8 bytes, followed by the uint64 start offsets of all keys
+    plus the end offset, the build height and finally the number of keys,
+    both as uint64."""
+
+    def __init__(self, path):
+        self.path = path
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "rb") as fp:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(data)
+        (height, count) = [int(n) for n in np.frombuffer(
+            data, dtype=np.uint64, count=2, offset=size - 16)]
+        offsets = np.frombuffer(data, dtype=np.uint64, count=count + 1,
+                                offset=size - 8 * (count + 3))
+        keys = IndexKeys(data, offsets, height)
+        previous = getattr(self, "keys", None)
+        if previous is not None and previous.height > height:
+            # keep the keys added for blocks the new file does not cover
+            keys = keys.extended(previous.recent, previous.height)
+        # published in one assignment, so a search running in another
+        # thread sees either the old or the new file, never a mix of both
+        self.keys = keys
+        self.mtime = mtime
+
+    def reload_if_changed(self):
+        if os.path.getmtime(self.path) != self.mtime:
+            self.load()
+
+    @property
+    def height(self):
+        """Height of the last block whose keys are in the index."""
+        return self.keys.height
+
+    def extend(self, keys, height):
+        """Add the str keys of the blocks up to height."""
+        self.keys = self.keys.extended([key.encode() for key in keys], height)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        return self.keys[i]
+
+    def search(self, prefix, limit):
+        """Return up to limit keys starting with prefix, in sorted order."""
+        prefix = prefix.encode()
+        keys = self.keys
+        start = bisect.bisect_left(keys, prefix)
+        found = []
+        for i in range(start, min(start + limit, len(keys))):
+            key = keys[i]
+            if not key.startswith(prefix):
+                break
+            found.append(key)
+        start = bisect.bisect_left(keys.recent, prefix)
+        recent = [key for key in keys.recent[start:start + limit]
+                  if key.startswith(prefix)]
+        result = []
+        for key in heapq.merge(found, recent):
+            if len(result) >= limit:
+                break
+            if not result or result[-1] != key:
+                result.append(key)
+        return [key.decode() for key in result]
+
+
+class IndexKeys(object):
+    """The keys of one version of an index file, as a sequence, with the
+    height it was built at and the sorted keys of later blocks."""
+
+    def __init__(self, data, offsets, height, recent=()):
+        self.data = data
+        self.offsets = offsets
+        self.height = height
+        self.recent = list(recent)
+
+    def extended(self, keys, height):
+        return IndexKeys(self.data, self.offsets, height,
+                         sorted(set(self.recent).union(keys)))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1]) - 1]
+
+
+class LabelIndex(object):
+    """Normalized labels in sorted order, with the label shown for each and
+    its number of addresses, for prefix completion ranked by the number of
+    addresses."""
+
+    def __init__(self, rows):
+        rows = sorted(rows)
+        self.labels_norm = [label_norm for (label_norm, _, _) in rows]
+        self.labels = [label for (_, label, _) in rows]
+        self.address_counts = [address_count for (_, _, address_count) in rows]
+
+    def __len__(self):
+        return len(self.labels_norm)
+
+    def search(self, expression_norm, limit):
+        """Return up to limit distinct labels whose normalized label starts
+        with expression_norm, the ones with most addresses first."""
+        start = bisect.bisect_left(self.labels_norm, expression_norm)
+        end = bisect.bisect_left(self.labels_norm, expression_norm + chr(0x10ffff), start)
+        # distinct normalized labels show distinct labels in the usual
+        # case, so only the best matches need to be ranked; more are
+        # taken if duplicates leave fewer than limit labels
+        wanted = limit
+        while True:
+            matches = heapq.nlargest(wanted, range(start, end),
+                                     key=lambda i: self.address_counts[i])
+            labels = list(dict.fromkeys(self.labels[i] for i in matches))
+            if len(labels) >= limit or len(matches) < wanted:
+                return labels[:limit]
+            wanted *= 2
+
+
+def index_path(directory, name):
+    return os.path.join(directory, "%s.index" % name)
+
+
+def open_index(directory, name):
+    """Return the index called name in directory, None if it was not built."""
+    path = index_path(directory, name)
+    return PrefixIndex(path) if os.path.exists(path) else None
+
+
+def write_run(keys, directory):
+    with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as fp:
+        for key in sorted(keys):
+            fp.write(key + b"\n")
+    return fp.name
+
+
+def read_run(path):
+    with open(path, "rb") as fp:
+        for line in fp:
+            yield line[:-1]
+
+
+def write_index(directory, name, keys, height, run_size=1000000):
+    """Write the index called name from an iterable of str keys, which
+    cover the blocks up to height.
+
+    Keys are sorted in runs of run_size keys which are then merged, so
+    memory use does not grow with the number of keys. The index file is
+    replaced atomically; open indices pick it up in reload_if_changed."""
+    os.makedirs(directory, exist_ok=True)
+    runs = []
+    try:
+        run = []
+        for key in keys:
+            run.append(key.encode())
+            if len(run) >= run_size:
+                runs.append(write_run(run, directory))
+                run = []
+        runs.append(write_run(run, directory))
+
+        path = index_path(directory, name)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as fp, \
+                tempfile.TemporaryFile(dir=directory) as offsets:
+            offset = 0
+            count = 0
+            previous = None
+            chunk = []
+            for key in heapq.merge(*[read_run(run) for run in runs]):
+                if key == previous:
+                    continue
+                previous = key
+                chunk.append(offset)
+                fp.write(key + b"\n")
+                offset += len(key) + 1
+                count += 1
+                if len(chunk) >= run_size:
+                    np.array(chunk, dtype=np.uint64).tofile(offsets)
+                    chunk = []
+            chunk.append(offset)
+            np.array(chunk, dtype=np.uint64).tofile(offsets)
+            fp.write(b"\0" * (-offset % 8))
+            offsets.seek(0)
+            for block in iter(lambda: offsets.read(1 << 20), b""):
+                fp.write(block)
+            np.array([height, count], dtype=np.uint64).tofile(fp)
+        os.replace(tmp_path, path)
+    finally:
+        for run in runs:
+            os.remove(run)
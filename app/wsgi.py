@@ -1,13 +1,20 @@
+import uwsgi
 from uwsgidecorators import postfork
 from graphsenserest import app as application
 from graphsensedao import connect
+import metrics
 
 
 @postfork
 def postfork_connect():
+    # a respawned worker replaces one whose gauges are still counted
+    metrics.mark_dead_workers()
     connect(application)
 
 
+uwsgi.atexit = metrics.mark_process_dead
+
+
 if __name__ == "__main__":
     # deactivate debug and multiple processes in production
     # because of memory usage and security
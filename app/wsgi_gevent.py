@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# Serves the REST interface from a single gevent process: each request runs
+# in its own greenlet and yields while it waits for Cassandra, so one
+# process keeps many requests in flight. Requires `pip install gevent`.
+#
+#     cd app/
+#     python3 wsgi_gevent.py [<port>]
+from gevent import monkey
+monkey.patch_all()
+
+import sys  # noqa: E402
+from cassandra.io.geventreactor import GeventConnection  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+from graphsenserest import app as application  # noqa: E402
+from graphsensedao import connect  # noqa: E402
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 9000
+    connect(application, connection_class=GeventConnection)
+    pool = Pool(application.config.get("GEVENT_POOL_SIZE", 1000))
+    server = WSGIServer(("0.0.0.0", port), application, spawn=pool)
+    application.logger.info("Serving on port %d" % port)
+    server.serve_forever()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark of the two JSON paths of the listing endpoints: marshal with
+json.dumps, as flask-restplus does, against the shapers compiled by
+fastjson with its encoder (orjson if installed).
+
+    cd test/
+    python3 benchmark_json.py [<rows per page>]
+"""
+
+import json
+import os
+import sys
+import time
+import numpy as np
+from flask_restplus import Model, fields, marshal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import fastjson  # noqa: E402
+import graphsensemodel as gm  # noqa: E402
+from benchmark_models import (  # noqa: E402
+    BlockTransactionsRow, block_transaction_row, cluster_address_row,
+    exchange_rate, rates)
+
+
+# same fields as the response models in graphsenserest.py
+value_response = Model("value_response", {
+    "eur": fields.Integer, "satoshi": fields.Integer, "usd": fields.Integer})
+tx_response = Model("tx_response", {
+    "height": fields.Integer, "timestamp": fields.Integer, "tx_hash": fields.String})
+cluster_address_response = Model("cluster_address_response", {
+    "cluster": fields.Integer,
+    "address": fields.String,
+    "address_prefix": fields.String,
+    "balance": fields.Nested(value_response),
+    "firstTx": fields.Nested(tx_response),
+    "lastTx": fields.Nested(tx_response),
+    "inDegree": fields.Integer,
+    "outDegree": fields.Integer,
+    "noIncomingTxs": fields.Integer,
+    "noOutgoingTxs": fields.Integer,
+    "totalReceived": fields.Nested(value_response),
+    "totalSpent": fields.Nested(value_response)})
+cluster_addresses_response = Model("cluster_addresses_response", {
+    "nextPage": fields.String,
+    "addresses": fields.List(fields.Nested(cluster_address_response))})
+block_transaction_response = Model("block_transaction_response", {
+    "noInputs": fields.Integer,
+    "noOutputs": fields.Integer,
+    "totalInput": fields.Nested(value_response),
+    "totalOutput": fields.Nested(value_response),
+    "txHash": fields.String})
+block_transactions_response = Model("block_transactions_response", {
+    "height": fields.Integer,
+    "txs": fields.List(fields.Nested(block_transaction_response))})
+
+
+def marshal_path(data, model):
+    return json.dumps(marshal(data, model)).encode()
+
+
+def fast_path(data, model):
+    return fastjson.dumps(fastjson.shaper(model)(data))
+
+
+def measure(name, data, model, no_rows):
+    assert json.loads(marshal_path(data, model)) == json.loads(fast_path(data, model))
+    for path in (marshal_path, fast_path):
+        repeat = 10
+        start = time.perf_counter()
+        for i in range(repeat):
+            path(data, model)
+        elapsed = time.perf_counter() - start
+        print("%-18s %-12s %6.2f us/row"
+              % (name, path.__name__, elapsed * 1e6 / repeat / no_rows))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print("encoder: %s" % ("orjson" if fastjson.orjson else "json"))
+    addresses = [gm.ClusterAddresses(cluster_address_row(i), exchange_rate)
+                 for i in range(n)]
+    measure("cluster addresses", {"nextPage": None, "addresses": addresses},
+            cluster_addresses_response, n)
+    block = gm.BlockWithTransactions(
+        BlockTransactionsRow(500000, [block_transaction_row(i) for i in range(n)]),
+        np.array(rates))
+    measure("block transactions", block, block_transactions_response, n)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the model layer: builds pages of models from
+synthetic rows and reports time and allocated memory per row.
+
+    cd test/
+    python3 benchmark_models.py [<rows per page>]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import graphsensemodel as gm  # noqa: E402
+
+
+TxIdTime = namedtuple("TxIdTime", "height tx_hash timestamp")
+Value = namedtuple("Value", "satoshi eur usd")
+ClusterAddressRow = namedtuple(
+    "ClusterAddressRow",
+    "cluster address no_incoming_txs no_outgoing_txs first_tx last_tx "
+    "total_received total_spent in_degree out_degree")
+AddressTransactionRow = namedtuple(
+    "AddressTransactionRow",
+    "address address_prefix tx_hash value height timestamp tx_index")
+BlockTransactionRow = namedtuple(
+    "BlockTransactionRow",
+    "tx_hash no_inputs no_outputs total_input total_output")
+BlockTransactionsRow = namedtuple("BlockTransactionsRow", "height txs")
+
+exchange_rate = gm.ExchangeRate({"eur": 9032.17, "usd": 10143.82})
+rates = [exchange_rate.eur, exchange_rate.usd]
+
+
+def cluster_address_row(i):
+    return ClusterAddressRow(
+        59468308, "1Arch17xM2rBqDSLhPKc9WF9hnsuHbUiw%d" % i, 12, 7,
+        TxIdTime(400000 + i, os.urandom(32), 1500000000 + i),
+        TxIdTime(500000 + i, os.urandom(32), 1550000000 + i),
+        Value(123456789 + i, 1234.567, 1543.219),
+        Value(23456789 + i, 234.567, 343.219), 3, 5)
+
+
+def address_transaction_row(i):
+    return AddressTransactionRow(
+        "1Arch17xM2rBqDSLhPKc9WF9hnsuHbUiwB", "1Arch", os.urandom(32),
+        -123456789 + i, 500000 + i, 1550000000 + i, i)
+
+
+def block_transaction_row(i):
+    return BlockTransactionRow(os.urandom(32), 2, 3, 123456789 + i, 123446789 + i)
+
+
+def measure(name, page_of_models, rows):
+    """Time per row and memory per row of a page of models, as handed to
+    marshal, and of converting the page to plain dicts."""
+    start = time.perf_counter()
+    page = page_of_models(rows)
+    built = time.perf_counter()
+    [item.to_dict() for item in page]
+    converted = time.perf_counter()
+    del page
+
+    tracemalloc.start()
+    page = page_of_models(rows)
+    (retained, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del page
+
+    print("%-20s %6.2f us/row build %6.2f us/row to_dict %6.0f B/row retained %6.0f B/row peak"
+          % (name, (built - start) * 1e6 / len(rows),
+             (converted - built) * 1e6 / len(rows),
+             retained / len(rows), peak / len(rows)))
+
+
+def measure_block(no_txs):
+    """Time of the model layer of /<currency>/block/<height>/transactions
+    for a block of no_txs transactions."""
+    block = BlockTransactionsRow(
+        500000, [block_transaction_row(i) for i in range(no_txs)])
+    repeat = 20
+    start = time.perf_counter()
+    for i in range(repeat):
+        gm.BlockWithTransactions(block, rates).to_dict()
+    elapsed = time.perf_counter() - start
+    print("%-20s %6.2f ms/block of %d transactions"
+          % ("BlockWithTransactions", elapsed * 1e3 / repeat, no_txs))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    measure("ClusterAddresses",
+            lambda rows: [gm.ClusterAddresses(row, exchange_rate) for row in rows],
+            [cluster_address_row(i) for i in range(n)])
+    measure("AddressTransactions",
+            lambda rows: gm.address_transactions(rows, np.tile(rates, (len(rows), 1))),
+            [address_transaction_row(i) for i in range(n)])
+    measure("BlockTransaction",
+            lambda rows: gm.block_transactions(rows, rates),
+            [block_transaction_row(i) for i in range(n)])
+    measure_block(3000)
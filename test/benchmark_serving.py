@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Throughput benchmark of a running REST interface: sends the same
+request from many concurrent clients and reports requests per second and
+latency percentiles. Run it once against the uWSGI setup and once against
+wsgi_gevent.py to compare both.
+
+    cd test/
+    python3 benchmark_serving.py <base url> <user> <password> <path> [<clients> [<requests>]]
+
+e.g. python3 benchmark_serving.py http://localhost:9000 admin test123 /btc/address/<address> 200 5000
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+def login(base_url, user, password):
+    response = requests.get(base_url + "/login", auth=(user, password))
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def run(url, token, clients, no_requests):
+    headers = {"Authorization": "Bearer " + token}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=clients)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def request(i):
+        start = time.perf_counter()
+        status = session.get(url, headers=headers).status_code
+        return (status, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        results = list(executor.map(request, range(no_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for (_, latency) in results)
+    errors = sum(1 for (status, _) in results if status != 200)
+    print("%d requests, %d clients: %.0f requests/s, %d errors"
+          % (no_requests, clients, no_requests / elapsed, errors))
+    for percentile in (50, 90, 99):
+        latency = latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)]
+        print("  p%d %7.1f ms" % (percentile, latency * 1e3))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print(__doc__)
+        sys.exit(1)
+    (base_url, user, password, path) = sys.argv[1:5]
+    clients = int(sys.argv[5]) if len(sys.argv) > 5 else 100
+    no_requests = int(sys.argv[6]) if len(sys.argv) > 6 else 2000
+    run(base_url.rstrip("/") + path, login(base_url, user, password),
+        clients, no_requests)
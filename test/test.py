@@ -1,9 +1,14 @@
 import unittest
+import io
 import json
+import logging
 from flask_cors import CORS
 from requests.auth import _basic_auth_str
 from graphsenserest import app
 import graphsensedao as gd
+import cassandraconfig
+import columnar
+import metrics
 
 
 class FlaskBookshelfTests(unittest.TestCase):
@@ -75,6 +80,9 @@ class FlaskBookshelfTests(unittest.TestCase):
         # assert the status code of the response
         self.assertEqual(200, result.status_code)
         # assert the response data
+        # the revoked token is rejected right away
+        result = self.app.get("/stats", headers=self.headers)
+        self.assertEqual(402, result.status_code)
 
     def test_03_relogin(self):
         # sends HTTP GET request to the application
@@ -302,3 +310,160 @@ class FlaskBookshelfTests(unittest.TestCase):
         # assert the status code of the response
         self.assertEqual(result.status_code, 200)
         print(result.json)
+
+    def test_33_exchange_rates_range(self):
+        # "/<currency>/exchangerates?from_height=&to_height=&step="
+        result = self.app.get("/btc/exchangerates?from_height=10&to_height=110&step=10", headers=self.headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        response = result.json
+        self.assertEqual(response["fromHeight"], 10)
+        self.assertEqual(response["toHeight"], 110)
+        self.assertEqual(len(response["eur"]), 11)
+        self.assertEqual(len(response["usd"]), 11)
+
+    def test_34_address_transactions_stream(self):
+        # "/<currency>/address/<address>/transactions?stream=1"
+        result = self.app.get("/btc/address/%s/transactions?stream=1&pagesize=2" % self.address, headers=self.headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        response = json.loads(str(result.data, result.charset))
+        self.assertIsNone(response["nextPage"])
+        self.assertTrue(type(response["transactions"]) is list)
+
+        headers = dict(self.headers, Accept="application/x-ndjson")
+        result = self.app.get("/btc/address/%s/transactions?pagesize=2" % self.address, headers=headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        lines = str(result.data, result.charset).splitlines()
+        self.assertEqual(len(lines), len(response["transactions"]))
+
+    def test_35_address_transactions_export(self):
+        # "/<currency>/address/<address>/transactions.csv"
+        result = self.app.get("/btc/address/%s/transactions.csv?pagesize=2" % self.address, headers=self.headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        lines = str(result.data, result.charset).splitlines()
+        self.assertTrue(lines[0].startswith("address,"))
+        # "/<currency>/address/<address>/transactions.ndjson"
+        result = self.app.get("/btc/address/%s/transactions.ndjson?pagesize=2" % self.address, headers=self.headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(str(result.data, result.charset).splitlines()), len(lines) - 1)
+
+    def test_36_batch(self):
+        # "/<currency>/batch/addresses"
+        result = self.app.post("/btc/batch/addresses", headers=self.headers,
+                               json={"addresses": [self.address, "1NotAnAddress"]})
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        items = result.json["items"]
+        self.assertEqual(items[0]["result"]["address"], self.address)
+        self.assertIsNotNone(items[1]["error"])
+        # "/<currency>/batch/transactions"
+        result = self.app.post("/btc/batch/transactions", headers=self.headers,
+                               json={"transactions": [self.txhash, "xyz"]})
+        self.assertEqual(result.status_code, 200)
+        items = result.json["items"]
+        self.assertEqual(items[0]["result"]["txHash"], self.txhash)
+        self.assertEqual(items[1]["error"], "Transaction hash is not hex")
+        # "/<currency>/batch/clusters"
+        result = self.app.post("/btc/batch/clusters", headers=self.headers,
+                               json={"clusters": [self.clusterId]})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json["items"][0]["result"]["cluster"], self.clusterId)
+        result = self.app.post("/btc/batch/clusters", headers=self.headers,
+                               json={"clusters": ["\u00b2", "-1", "x"]})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([item["error"] for item in result.json["items"]], ["Invalid cluster ID"] * 3)
+
+    @unittest.skipIf(columnar.msgpack is None, "msgpack is not installed")
+    def test_37_cluster_addresses_msgpack(self):
+        # "/<currency>/cluster/<cluster>/addresses" with Accept: application/x-msgpack
+        result = self.app.get("/btc/cluster/%s/addresses?pagesize=5" % self.clusterId, headers=self.headers)
+        addresses = result.json["addresses"]
+        headers = dict(self.headers, Accept="application/x-msgpack")
+        result = self.app.get("/btc/cluster/%s/addresses?pagesize=5" % self.clusterId, headers=headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        columns = columnar.msgpack.unpackb(result.data, raw=False)["addresses"]
+        self.assertEqual(columns["address"], [address["address"] for address in addresses])
+        self.assertEqual(columns["balance"]["satoshi"],
+                         [address["balance"]["satoshi"] for address in addresses])
+
+    def test_38_pagesize_per_request(self):
+        # a pagesize applies to its own request only; without one the page
+        # size adapts to earlier requests, so explicit sizes are compared
+        fetch_size = gd.cluster_addresses_without_limit_query["btc"].fetch_size
+        result = self.app.get("/btc/cluster/%s/addresses?pagesize=5" % self.clusterId, headers=self.headers)
+        addresses = result.json["addresses"]
+        result = self.app.get("/btc/cluster/%s/addresses?pagesize=1" % self.clusterId, headers=self.headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        self.assertLessEqual(len(result.json["addresses"]), 1)
+        result = self.app.get("/btc/cluster/%s/addresses?pagesize=5" % self.clusterId, headers=self.headers)
+        self.assertEqual(result.json["addresses"], addresses)
+        # page sizes are set on bound statements, not the prepared one
+        self.assertEqual(gd.cluster_addresses_without_limit_query["btc"].fetch_size, fetch_size)
+
+    @unittest.skipIf(metrics.prometheus_client is None, "prometheus_client is not installed")
+    def test_39_metrics(self):
+        # "/metrics"
+        self.app.get("/btc/address/%s" % self.address, headers=self.headers)
+        result = self.app.get("/metrics")
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        text = result.data.decode()
+        self.assertIn('graphsense_request_seconds_count{endpoint="address"', text)
+        self.assertIn('graphsense_query_seconds_count{statement="address_query"}', text)
+
+    def test_40_cluster_search_neighbors(self):
+        # "/<currency>/cluster/<cluster>/search"
+        result = self.app.get("/btc/cluster/%s/search?direction=out&depth=2" % self.clusterId, headers=self.headers)
+        # assert the status code of the response
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(result.json["truncated"])
+
+        result = self.app.get("/btc/cluster/%s/neighbors?direction=out&pagesize=1" % self.clusterId, headers=self.headers)
+        if not result.json["neighbors"]:
+            self.skipTest("cluster has no outgoing neighbors")
+        # a budget of one query only expands the cluster itself
+        budget = gd.search_budget
+        gd.search_budget = {"MAX_QUERIES": 1}
+        try:
+            result = self.app.get("/btc/cluster/%s/search?direction=out&depth=2" % self.clusterId, headers=self.headers)
+        finally:
+            gd.search_budget = budget
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(result.json["truncated"])
+        self.assertEqual(result.json["paths"], [])
+
+        addresses = ",".join("%s%d" % (self.address, i) for i in range(101))
+        result = self.app.get("/btc/cluster/%s/search?direction=out&addresses=%s" % (self.clusterId, addresses), headers=self.headers)
+        self.assertEqual(result.status_code, 400)
+
+    def test_41_stream_unknown_currency(self):
+        # errors of the first page are reported before streaming starts
+        result = self.app.get("/xyz/address/%s/transactions?stream=1" % self.address, headers=self.headers)
+        self.assertEqual(result.status_code, 404)
+
+    def test_42_export_invalid_args(self):
+        # "/<currency>/address/<address>/transactions.csv" and ".ndjson"
+        for export in ("csv", "ndjson"):
+            for args in ("pagesize=0", "pagesize=-1", "limit=0"):
+                result = self.app.get("/btc/address/%s/transactions.%s?%s" % (self.address, export, args), headers=self.headers)
+                self.assertEqual(result.status_code, 404)
+            result = self.app.get("/xyz/address/%s/transactions.%s" % (self.address, export), headers=self.headers)
+            self.assertEqual(result.status_code, 404)
+
+    def test_43_startup_log(self):
+        # the Cassandra settings are logged at INFO, also under uWSGI
+        # where the root logger is left at WARNING
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        app.logger.addHandler(handler)
+        try:
+            gd.log_cluster_options(app, cassandraconfig.cluster_options(app.config.get("CASSANDRA", {})))
+        finally:
+            app.logger.removeHandler(handler)
+        self.assertIn("Cassandra profile lookup", stream.getvalue())